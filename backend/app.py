@@ -1,115 +1,344 @@
 import os
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import uuid
 import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+import hashlib
+import itertools
+import re
+import time
+import click
 import psycopg2
 from psycopg2 import sql
 import psycopg2.extras # Needed for DictCursor
+import psycopg2.errors
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-# ReportLab imports
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph
-from io import BytesIO
+from auth import ACCESS_TOKEN_TTL, AUTH_CONFIGURED, REQUIRE_AUTH_TOKEN, InvalidToken, issue_token, verify_token, revoke_token, bearer_token, token_challenge
+from bulk_import import (
+    BULK_INSERT_CHUNK_SIZE, ImportFormatError, read_records, normalize_records, prepare_records, insert_requisitions,
+)
+from db import DATABASE_REPLICA_URLS, db_connection, read_connection, write_position, server_timezone, pool_stats
+from json_provider import FastJSONProvider
+from migrations import MIGRATIONS, LATEST_VERSION, migrate, schema_version
+from metrics import start_request, finish_request, end_request, render_latest
+from events import (
+    TooManyStreams, requisition_event, notify_requisition_events, get_broker, event_filter, sse_stream,
+)
+from export import stream_csv, copy_csv, write_xlsx, xlsx_tempfile
+from passwords import HashingBusy, hash_password, verify_password, needs_rehash
+from pdf_render import cache_key, cached_pdf, submit_render, render_status, invalidate_requisition_pdfs
+from requisitions import (
+    PENDING_STATUS, DECISION_STATUSES, BULK_DECISION_ROLES, BULK_DECISION_MAX_IDS,
+    DEFAULT_PAGE_SIZE, STREAM_BATCH_SIZE, utc_timestamp,
+    REQUISITION_COLUMNS, InvalidQuery, build_requisition_filters, search_terms, where_clause,
+    is_paginated, parse_page_size, encode_cursor, keyset_condition, page_validator,
+    parse_fields, select_requisitions, select_changes, decode_sync_token,
+    build_requisition_data, missing_mandatory_field,
+)
+from sql_profile import start_profile, current_profile, finish_profile
 
 
 app = Flask(__name__)
 # IMPORTANT: For production, replace "*" with your Render frontend URL (e.g., "https://your-frontend.onrender.com")
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["X-DB-Read-After", "WWW-Authenticate"]}})
+app.json = FastJSONProvider(app)
 
-# --- DATABASE CONFIGURATION FOR POSTGRESQL ---
-DATABASE_URL = os.environ.get('DATABASE_URL')
+# Lets any caller request a Server-Timing SQL breakdown, not just admins.
+SQL_PROFILE_ENABLED = os.environ.get('SQL_PROFILE_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Upper bound on the rows accepted by one POST /api/requisitions/bulk.
+BULK_CREATE_MAX_ROWS = int(os.environ.get('BULK_CREATE_MAX_ROWS', 5000))
+# Columns that identify a rendered PDF (its cache key and ETag).
+PDF_VERSION_COLUMNS = "id, status, decision_at"
+# Every column of a requisition, leaving out the derived search_vector.
+ALL_REQUISITION_COLUMNS = ", ".join(REQUISITION_COLUMNS)
+# Seconds of recent changes re-sent by /api/requisitions/changes, covering
+# transactions that commit slightly after their updated_at timestamp.
+SYNC_COMMIT_LAG = float(os.environ.get('SYNC_COMMIT_LAG', 5))
+# Seconds a download request waits for a fresh render before answering 202.
+PDF_RENDER_WAIT = float(os.environ.get('PDF_RENDER_WAIT', 5))
+# WAL position of the caller's last write, e.g. "0/16B3748". Clients send it
+# back so they read their own writes even from a lagging replica.
+READ_AFTER_HEADER = 'X-DB-Read-After'
+LSN_PATTERN = re.compile(r'^[0-9A-F]{1,8}/[0-9A-F]{1,8}$')
 
-def get_db_connection():
-    """Establishes a PostgreSQL database connection."""
-    if not DATABASE_URL:
-        raise Exception("DATABASE_URL environment variable is not set.")
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+@app.cli.command('db-upgrade')
+@click.option('--target', type=int, help="Stop at this migration version.")
+def db_upgrade_command(target):
+    """Applies pending schema migrations (run once per release, not per worker)."""
+    with db_connection() as conn:
+        applied = migrate(conn, target)
+        version = schema_version(conn)
+    for applied_version, name in applied:
+        print(f"Applied migration {applied_version}: {name}")
+    print(f"Database schema is at version {version} (latest {LATEST_VERSION})")
 
-def init_db():
-    """Initializes the database schema for PostgreSQL."""
-    conn = None
+@app.cli.command('db-status')
+def db_status_command():
+    """Prints the applied and pending schema migrations."""
+    with db_connection() as conn:
+        version = schema_version(conn)
+    print(f"Database schema is at version {version} (latest {LATEST_VERSION})")
+    for migration_version, name, _ in MIGRATIONS:
+        print(f"  {'applied' if migration_version <= version else 'pending'}  {migration_version}: {name}")
+
+@app.cli.command('import-requisitions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=BULK_INSERT_CHUNK_SIZE, show_default=True, help="Rows per INSERT/commit.")
+def import_requisitions_command(path, chunk_size):
+    """Bulk-loads requisitions from a JSON array, CSV or XLSX file."""
+    with open(path, 'rb') as stream:
+        try:
+            records = read_records(stream, path)
+        except ImportFormatError as e:
+            raise click.ClickException(str(e))
+
+    rows, errors = prepare_records(records)
+    with db_connection() as conn:
+        created, insert_errors = insert_requisitions(conn, rows, chunk_size=chunk_size)
+
+    errors = sorted(errors + insert_errors, key=lambda error: error['index'])
+    print(f"Imported {len(created)} of {len(records)} requisitions from {path}")
+    for error in errors:
+        # Report 1-based record numbers, which match JSON array positions and
+        # spreadsheet data rows (excluding the header).
+        print(f"  record {error['index'] + 1}: {error['message']}")
+
+@app.cli.command('export-requisitions')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'xlsx']), help="Defaults to the file extension.")
+@click.option('--status')
+@click.option('--user-id', 'user_id')
+@click.option('--basin')
+@click.option('--user-group', 'user_group')
+@click.option('--dimension')
+@click.option('--search', help="Full-text search, like the q= parameter.")
+def export_requisitions_command(path, export_format, status, user_id, basin, user_group, dimension, search):
+    """Exports requisitions with the same filters as GET /api/requisitions."""
+    export_format = export_format or ('xlsx' if path.lower().endswith('.xlsx') else 'csv')
+    args = {'status': status, 'userId': user_id, 'basin': basin, 'userGroup': user_group,
+            'dimension': dimension, 'q': search}
+    conditions, params = build_requisition_filters(args)
+    with db_connection() as conn:
+        if export_format == 'xlsx':
+            write_xlsx(conn, conditions, params, path)
+        else:
+            with open(path, 'wb') as target:
+                copy_csv(conn.cursor(), conditions, params, target)
+    print(f"Exported requisitions to {path}")
+
+@app.cli.command('explain-requisition-filters')
+@click.option('--analyze', is_flag=True, help="Run EXPLAIN ANALYZE (executes the queries).")
+def explain_requisition_filters(analyze):
+    """Prints query plans for every get_requisitions filter combination."""
+    with db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        # Use real values so the planner sees representative selectivity.
+        cursor.execute(
+            "SELECT status, requested_by_user_id, basin, user_group, dimension, title FROM requisitions LIMIT 1"
+        )
+        sample = cursor.fetchone() or {}
+        title_words = (sample.get('title') or '').split()
+        sample_args = {
+            'status': sample.get('status') or 'pending_level2',
+            'userId': sample.get('requested_by_user_id') or 'sample-user',
+            'basin': sample.get('basin') or 'sample-basin',
+            'userGroup': sample.get('user_group') or 'sample-group',
+            'dimension': sample.get('dimension') or 'sample-dimension',
+            'q': title_words[0] if title_words else 'sample',
+        }
+
+        explain = sql.SQL("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ")
+        for size in range(len(sample_args) + 1):
+            for keys in itertools.combinations(sample_args, size):
+                args = {key: sample_args[key] for key in keys}
+                conditions, params = build_requisition_filters(args)
+                # The same query get_requisitions runs, including the q= ranking.
+                query, query_params, _ = select_requisitions(
+                    list(REQUISITION_COLUMNS), conditions, params, search=search_terms(args)
+                )
+                cursor.execute(explain + query + sql.SQL(" LIMIT %s"), query_params + [DEFAULT_PAGE_SIZE + 1])
+                plan = [row[0] for row in cursor.fetchall()]
+                indexes = sorted({word for line in plan for word in line.split() if word.startswith('idx_')})
+                print(f"== filters: {', '.join(keys) or '(none)'}")
+                print(f"   indexes used: {', '.join(indexes) or 'NONE (sequential scan)'}")
+                for line in plan:
+                    print(f"   {line}")
+        conn.rollback()
+
+# Set once this worker has compared the database schema with LATEST_VERSION.
+_schema_checked = False
+# Monotonic time before which a failed schema check isn't retried.
+_schema_check_retry_at = 0.0
+# Seconds between schema check attempts while the database is unreachable.
+SCHEMA_CHECK_RETRY_SECONDS = 30
+# Endpoints that never touch the database, so never trigger the check.
+SCHEMA_CHECK_EXEMPT_ENDPOINTS = {'home', 'static', 'metrics'}
+
+@app.before_request
+def check_schema_version():
+    """Warns once per worker when `flask db-upgrade` hasn't been run.
+
+    Runs on the first request rather than at import, so booting a worker
+    never waits on the database; a failed check is retried at most every
+    SCHEMA_CHECK_RETRY_SECONDS.
+    """
+    global _schema_checked, _schema_check_retry_at
+    if _schema_checked or request.method == 'OPTIONS' or request.endpoint in SCHEMA_CHECK_EXEMPT_ENDPOINTS:
+        return None
+    if time.monotonic() < _schema_check_retry_at:
+        return None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Create users table (email column removed)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id VARCHAR(255) PRIMARY KEY,
-                cpf_id VARCHAR(255) UNIQUE NOT NULL,
-                name VARCHAR(255),
-                password_hash VARCHAR(255) NOT NULL,
-                role VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                created_by VARCHAR(255)
-            )
-        ''')
-        # Create requisitions table - ADDED 'title' and 'description' back
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS requisitions (
-                id VARCHAR(255) PRIMARY KEY,
-                title TEXT, -- Added back
-                description TEXT, -- Added back
-                requisition_date DATE,
-                basin VARCHAR(255),
-                block VARCHAR(255),
-                area VARCHAR(255),
-                dimension VARCHAR(255),
-                return_date DATE,
-                data_type TEXT,
-                objective TEXT,
-                remarks TEXT,
-                user_name VARCHAR(255),
-                user_designation VARCHAR(255),
-                user_cpf_no VARCHAR(255),
-                user_mobile_no VARCHAR(255),
-                user_group VARCHAR(255),
-                requested_by_user_id VARCHAR(255),
-                requested_by_user_cpf_id VARCHAR(255),
-                status VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                approved_by_level2_user_id VARCHAR(255),
-                approved_by_level2_user_cpf_id VARCHAR(255),
-                approved_by_level2_user_name VARCHAR(255),
-                decision_at TIMESTAMP WITHOUT TIME ZONE
-            )
-        ''')
-        conn.commit()
-
-        # Add a default admin user if one doesn't exist
-        cursor.execute("SELECT id FROM users WHERE cpf_id = 'admin123'")
-        if cursor.fetchone() is None:
-            admin_id = str(uuid.uuid4())
-            hashed_password = generate_password_hash('password123')
-            # Insert statement adjusted: email field removed
-            cursor.execute(
-                """INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
-                VALUES (%s, %s, %s, %s, %s, %s)""",
-                (admin_id, 'admin123', 'Admin User', hashed_password, 'admin', 'system')
-            )
-            conn.commit()
-            print("Default admin user created: CPF ID: admin123 / Password: password123")
+        with db_connection() as conn:
+            version = schema_version(conn)
+    except psycopg2.Error as e:
+        _schema_check_retry_at = time.monotonic() + SCHEMA_CHECK_RETRY_SECONDS
+        print(f"Schema version check failed, retrying in {SCHEMA_CHECK_RETRY_SECONDS}s: {e}")
+        return None
+    _schema_checked = True
+    if version < LATEST_VERSION:
+        print(f"Database schema is at version {version} but this release expects {LATEST_VERSION}; "
+              f"run 'flask --app app db-upgrade'.")
+    return None
+
+# Routes reachable without an access token when REQUIRE_AUTH_TOKEN is on.
+PUBLIC_ENDPOINTS = {'home', 'login', 'static', 'metrics'}
+# Routes that also accept the token as ?access_token=, for browser
+# EventSource, which can't set an Authorization header.
+QUERY_TOKEN_ENDPOINTS = {'requisition_events'}
+
+def metrics_route():
+    # The URL rule, not the path, so ids don't explode the label set.
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_route = metrics_route()
+    g.metrics_started = start_request(request.method, g.metrics_route)
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_started' in g:
+        # Only the Content-Length header: calculate_content_length() would
+        # drain a streamed body (NDJSON, CSV, SSE) into memory to measure it.
+        finish_request(request.method, g.metrics_route, g.metrics_started,
+                       response.status_code, response.content_length)
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    if 'metrics_started' in g:
+        end_request(request.method, g.metrics_route)
+
+@app.before_request
+def authenticate_request():
+    """Verifies the bearer token, if any, and exposes its claims as g.current_user.
+
+    Verification only checks the signature, expiry and the in-process
+    revocation cache; it never queries the database.
+    """
+    g.current_user = None
+    if request.method == 'OPTIONS':
+        return None
+    token_required = REQUIRE_AUTH_TOKEN and request.endpoint not in PUBLIC_ENDPOINTS
+    token = bearer_token(request.headers.get('Authorization'))
+    if not token and request.endpoint in QUERY_TOKEN_ENDPOINTS:
+        token = request.args.get('access_token')
+    if token:
+        try:
+            g.current_user = verify_token(token)
+        except InvalidToken as e:
+            # Where a token is optional, an expired or foreign one (e.g. signed
+            # before a restart) just leaves the caller anonymous.
+            if token_required:
+                return jsonify({"message": str(e)}), 401, {'WWW-Authenticate': token_challenge('invalid_token')}
+    elif token_required:
+        return jsonify({"message": "Authentication required"}), 401, {'WWW-Authenticate': token_challenge()}
+    return None
+
+@app.before_request
+def start_sql_profile():
+    """Collects per-statement SQL timings when the caller sends X-SQL-Profile: 1.
+
+    Honoured for admins, or for everyone when SQL_PROFILE_ENABLED is set
+    (e.g. in staging); the result is returned as a Server-Timing header.
+    """
+    if request.headers.get('X-SQL-Profile') not in ('1', 'true'):
+        return None
+    if SQL_PROFILE_ENABLED or (g.current_user and g.current_user['role'] == 'admin'):
+        g.sql_profile = True
+        start_profile()
+    return None
+
+@app.after_request
+def add_sql_profile_header(response):
+    profile = current_profile() if g.get('sql_profile') else None
+    if profile is not None:
+        # Statements run while a streamed body is produced come too late to
+        # be included here.
+        response.headers['Server-Timing'] = profile.server_timing()
+    return response
+
+@app.teardown_request
+def end_sql_profile(exc):
+    # Threads serve many requests, so never leave a profile behind.
+    if g.pop('sql_profile', False):
+        finish_profile()
+
+def record_write(conn):
+    """Notes where the write just committed on `conn` ends in the WAL.
+
+    It is returned in the READ_AFTER_HEADER response header; clients echo it
+    so their following reads only use replicas that have replayed it.
+    """
+    if not DATABASE_REPLICA_URLS:
+        return
+    try:
+        g.write_lsn = write_position(conn)
     except psycopg2.Error as e:
-        print(f"Database initialization error: {e}")
-        if conn:
-            conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+        # The write is committed; only read-your-writes is lost.
+        print(f"Could not read the WAL position after a write: {e}")
 
-with app.app_context():
-    init_db()
+def read_after():
+    """The write position echoed by the caller, or None when any replica will do."""
+    if not DATABASE_REPLICA_URLS:
+        return None
+    lsn = request.headers.get(READ_AFTER_HEADER, '').strip().upper()
+    return lsn if LSN_PATTERN.match(lsn) else None
+
+@app.after_request
+def add_read_after_header(response):
+    if 'write_lsn' in g:
+        response.headers[READ_AFTER_HEADER] = g.write_lsn
+    return response
+
+def identity_field(data, claim, body_key, default=None):
+    """Identity of the caller: the token's claim when authenticated, else the legacy body field."""
+    if g.current_user:
+        return g.current_user[claim]
+    return data.get(body_key, default)
+
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(e):
+    response = jsonify({"message": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({"message": "Welcome to the Flask API!"}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for every worker (see PROMETHEUS_MULTIPROC_DIR)."""
+    body, content_type = render_latest()
+    return Response(body, content_type=content_type)
+
+@app.route('/api/pool-stats', methods=['GET'])
+def get_pool_stats():
+    """Connection pool counters for this worker, used to size DB_POOL_MAX_SIZE."""
+    return jsonify(pool_stats()), 200
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -119,28 +348,57 @@ def login():
     if not cpf_id or not password:
         return jsonify({"message": "CPF ID and password are required"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("SELECT id, cpf_id, name, role, password_hash FROM users WHERE cpf_id = %s", (cpf_id,))
-        user = cursor.fetchone()
-
-        if user and check_password_hash(user['password_hash'], password):
-            return jsonify({
-                "message": "Login successful",
-                "cpfId": user['cpf_id'],
-                "uid": user['id'],
-                "name": user['name'],
-                "role": user['role']
-            }), 200
-        else:
-            return jsonify({"message": "Invalid CPF ID or password"}), 401
+        with db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute("SELECT id, cpf_id, name, role, password_hash FROM users WHERE cpf_id = %s", (cpf_id,))
+            user = cursor.fetchone()
     except psycopg2.Error as e:
         return jsonify({"message": f"Database error during login: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+    # The hash check runs after the connection is back in the pool.
+    if not user or not verify_password(user['password_hash'], password):
+        return jsonify({"message": "Invalid CPF ID or password"}), 401
+
+    if needs_rehash(user['password_hash']):
+        upgrade_password_hash(user['id'], user['password_hash'], password)
+
+    return jsonify({
+        "message": "Login successful",
+        "cpfId": user['cpf_id'],
+        "uid": user['id'],
+        "name": user['name'],
+        "role": user['role'],
+        "token": issue_token(user),
+        "tokenType": "Bearer",
+        "expiresIn": ACCESS_TOKEN_TTL
+    }), 200
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    """Revokes the caller's access token in this worker's revocation cache."""
+    if not g.current_user:
+        return jsonify({"message": "No access token supplied"}), 400
+    revoke_token(g.current_user)
+    return jsonify({"message": "Logged out"}), 200
+
+def upgrade_password_hash(user_id, old_hash, password):
+    """Re-hashes a verified password with the current PASSWORD_HASH_METHOD.
+
+    Best effort: a failure here never fails the login itself.
+    """
+    try:
+        new_hash = hash_password(password)
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Only replace the hash we verified, in case the password changed meanwhile.
+            cursor.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                (new_hash, user_id, old_hash)
+            )
+            conn.commit()
+    except (HashingBusy, psycopg2.Error) as e:
+        print(f"Password rehash skipped for user {user_id}: {e}")
 
 @app.route('/api/register', methods=['POST'])
 def register_user():
@@ -149,7 +407,7 @@ def register_user():
     cpf_id = data.get('cpfId')
     password = data.get('password')
     role = data.get('role')
-    created_by = data.get('createdBy', 'unknown')
+    created_by = identity_field(data, 'cpfId', 'createdBy', 'unknown')
 
     if not all([name, cpf_id, password, role]):
         return jsonify({"message": "Name, CPF ID, password, and role are required"}), 400
@@ -157,47 +415,41 @@ def register_user():
     if len(password) < 6:
         return jsonify({"message": "Password must be at least 6 characters long"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id FROM users WHERE cpf_id = %s", (cpf_id,))
-        if cursor.fetchone():
-            return jsonify({"message": "User with this CPF ID already exists"}), 409
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM users WHERE cpf_id = %s", (cpf_id,))
+            if cursor.fetchone():
+                return jsonify({"message": "User with this CPF ID already exists"}), 409
 
         user_id = str(uuid.uuid4())
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
 
-        cursor.execute(
-            """INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
-            VALUES (%s, %s, %s, %s, %s, %s)""",
-            (user_id, cpf_id, name, hashed_password, role, created_by)
-        )
-        conn.commit()
-        return jsonify({"message": "User registered successfully", "userId": user_id}), 201
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s)""",
+                (user_id, cpf_id, name, hashed_password, role, created_by)
+            )
+            conn.commit()
+            record_write(conn)
+            return jsonify({"message": "User registered successfully", "userId": user_id}), 201
+    except psycopg2.errors.UniqueViolation:
+        return jsonify({"message": "User with this CPF ID already exists"}), 409
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("SELECT id, cpf_id, name, role, created_at, created_by FROM users ORDER BY created_at DESC")
-        users = cursor.fetchall()
-        return jsonify([dict(user) for user in users]), 200
+        with read_connection(min_lsn=read_after()) as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute("SELECT id, cpf_id, name, role, created_at, created_by FROM users ORDER BY created_at DESC")
+            users = cursor.fetchall()
+            return jsonify(users), 200
     except psycopg2.Error as e:
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/users/<user_id>/password', methods=['PUT'])
 def change_password(user_id):
@@ -211,307 +463,628 @@ def change_password(user_id):
     if len(new_password) < 6:
         return jsonify({"message": "New password must be at least 6 characters long"}), 400
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
+        with db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute("SELECT id, password_hash FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
 
         if not user:
             return jsonify({"message": "User not found"}), 404
 
-        if not check_password_hash(user['password_hash'], current_password):
-            return jsonify({"message": "Incorrect current password"}), 401
-        
-        if check_password_hash(user['password_hash'], new_password):
+        if not verify_password(user['password_hash'], current_password):
+            return jsonify({"message": "Incorrect current password"}), 400
+
+        if verify_password(user['password_hash'], new_password):
             return jsonify({"message": "New password cannot be the same as current password"}), 400
 
-        hashed_new_password = generate_password_hash(new_password)
-        cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (hashed_new_password, user_id))
-        conn.commit()
-        return jsonify({"message": "Password changed successfully"}), 200
+        hashed_new_password = hash_password(new_password)
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET password_hash = %s WHERE id = %s", (hashed_new_password, user_id))
+            conn.commit()
+            record_write(conn)
+            return jsonify({"message": "Password changed successfully"}), 200
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/requisitions', methods=['POST'])
 def create_requisition():
     data = request.get_json()
 
-    requisition_data = {
-        'requisition_date': data.get('requisitionDate'),
-        'basin': data.get('basin'),
-        'block': data.get('block'),
-        'area': data.get('area'),
-        'dimension': data.get('dimension'),
-        'return_date': data.get('returnDate'),
-        'data_type': data.get('dataType'),
-        'objective': data.get('objective'),
-        'remarks': data.get('remarks'),
-        'user_name': data.get('userName'),
-        'user_designation': data.get('userDesignation'),
-        'user_cpf_no': data.get('userCPFNo'),
-        'user_mobile_no': data.get('userMobileNo'),
-        'user_group': data.get('userGroup'),
-        'requested_by_user_id': data.get('requestedByUserId'),
-        'requested_by_user_cpf_id': data.get('requestedByUserCpfId'),
-        'status': 'pending_level2',
-        'created_at': datetime.datetime.now(),
-        # Generate title and description from existing fields if not directly provided
-        'title': data.get('title', f"Requisition for {data.get('basin')} - {data.get('area') or 'N/A'}"),
-        'description': data.get('description', data.get('objective'))
-    }
-
-    mandatory_fields = ['basin', 'user_cpf_no', 'user_mobile_no', 'user_group']
-    for field in mandatory_fields:
-        if not requisition_data.get(field):
-            return jsonify({"message": f"Mandatory field '{field.replace('_', ' ').capitalize()}' is missing"}), 400
+    requisition_data = build_requisition_data(
+        data,
+        requested_by_user_id=identity_field(data, 'uid', 'requestedByUserId'),
+        requested_by_user_cpf_id=identity_field(data, 'cpfId', 'requestedByUserCpfId'),
+    )
+
+    missing_message = missing_mandatory_field(requisition_data)
+    if missing_message:
+        return jsonify({"message": missing_message}), 400
 
     req_id = str(uuid.uuid4())
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO requisitions (
-                id, title, description, requisition_date, basin, block, area, dimension, return_date,
-                data_type, objective, remarks, user_name, user_designation,
-                user_cpf_no, user_mobile_no, user_group, requested_by_user_id,
-                requested_by_user_cpf_id, status, created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                req_id, requisition_data['title'], requisition_data['description'],
-                requisition_data['requisition_date'], requisition_data['basin'],
-                requisition_data['block'], requisition_data['area'], requisition_data['dimension'],
-                requisition_data['return_date'], requisition_data['data_type'],
-                requisition_data['objective'], requisition_data['remarks'],
-                requisition_data['user_name'], requisition_data['user_designation'],
-                requisition_data['user_cpf_no'], requisition_data['user_mobile_no'],
-                requisition_data['user_group'], requisition_data['requested_by_user_id'],
-                requisition_data['requested_by_user_cpf_id'], requisition_data['status'],
-                requisition_data['created_at']
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO requisitions (
+                    id, title, description, requisition_date, basin, block, area, dimension, return_date,
+                    data_type, objective, remarks, user_name, user_designation,
+                    user_cpf_no, user_mobile_no, user_group, requested_by_user_id,
+                    requested_by_user_cpf_id, status, created_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (
+                    req_id, requisition_data['title'], requisition_data['description'],
+                    requisition_data['requisition_date'], requisition_data['basin'],
+                    requisition_data['block'], requisition_data['area'], requisition_data['dimension'],
+                    requisition_data['return_date'], requisition_data['data_type'],
+                    requisition_data['objective'], requisition_data['remarks'],
+                    requisition_data['user_name'], requisition_data['user_designation'],
+                    requisition_data['user_cpf_no'], requisition_data['user_mobile_no'],
+                    requisition_data['user_group'], requisition_data['requested_by_user_id'],
+                    requisition_data['requested_by_user_cpf_id'], requisition_data['status'],
+                    requisition_data['created_at']
+                )
             )
-        )
-        conn.commit()
-        return jsonify({"message": "Requisition created successfully", "id": req_id}), 201
+            notify_requisition_events(cursor, [
+                requisition_event('created', req_id, requisition_data['status'],
+                                  requisition_data['requested_by_user_id'])
+            ])
+            conn.commit()
+            record_write(conn)
+            return jsonify({"message": "Requisition created successfully", "id": req_id}), 201
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/api/requisitions/bulk', methods=['POST'])
+def bulk_create_requisitions():
+    """Creates many requisitions from a JSON array body or an uploaded .json/.csv/.xlsx file.
+
+    Rows are validated like create_requisition and loaded in chunks; invalid
+    rows are reported individually and never abort the rest of the batch.
+    """
+    try:
+        if 'file' in request.files:
+            upload = request.files['file']
+            records = read_records(upload.stream, upload.filename)
+        else:
+            records = request.get_json(silent=True)
+            if not isinstance(records, list):
+                return jsonify({"message": "Expected a JSON array of requisitions or a 'file' upload"}), 400
+            records = normalize_records(records)
+    except ImportFormatError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if len(records) > BULK_CREATE_MAX_ROWS:
+        return jsonify({"message": f"At most {BULK_CREATE_MAX_ROWS} requisitions can be created per request"}), 400
+
+    user = g.current_user
+    rows, errors = prepare_records(
+        records,
+        requested_by_user_id=user['uid'] if user else None,
+        requested_by_user_cpf_id=user['cpfId'] if user else None,
+    )
+    try:
+        with db_connection() as conn:
+            created, insert_errors = insert_requisitions(conn, rows)
+            if created:
+                record_write(conn)
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    errors = sorted(errors + insert_errors, key=lambda error: error['index'])
+    return jsonify({
+        "message": f"{len(created)} of {len(records)} requisitions created",
+        "created": len(created),
+        "failed": len(errors),
+        "ids": [{"index": index, "id": req_id} for index, req_id in created],
+        "errors": errors
+    }), 200
 
 @app.route('/api/requisitions', methods=['GET'])
 def get_requisitions():
-    status_filter = request.args.get('status')
-    user_id_filter = request.args.get('userId')
-    basin_filter = request.args.get('basin')
-    user_group_filter = request.args.get('userGroup')
+    # Without limit/cursor the full list is returned as before; with either of
+    # them the response is one keyset page plus the cursor for the next one.
+    paginated = is_paginated(request.args)
+    # With q= rows are filtered by full-text match and ordered by rank.
+    search = search_terms(request.args)
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        conditions, params = build_requisition_filters(request.args)
+        if paginated:
+            page_size = parse_page_size(request.args.get('limit'))
+            if request.args.get('cursor'):
+                condition, cursor_params = keyset_condition(request.args['cursor'], search)
+                conditions.append(condition)
+                params.extend(cursor_params)
+    except InvalidQuery as e:
+        return jsonify({"message": str(e)}), 400
+
+    if request.args.get('format') == 'ndjson':
+        return stream_requisitions_ndjson(fields, conditions, params, search)
 
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        with read_connection(min_lsn=read_after()) as conn:
+            # Plain tuple rows; names are attached only when serializing.
+            cursor = conn.cursor()
 
-        query_parts = ["SELECT * FROM requisitions WHERE 1=1"]
-        params = []
-
-        if status_filter:
-            query_parts.append(" AND status = %s")
-            params.append(status_filter)
-        if user_id_filter:
-            query_parts.append(" AND requested_by_user_id = %s")
-            params.append(user_id_filter)
-        if basin_filter:
-            query_parts.append(" AND basin ILIKE %s")
-            params.append(f"%{basin_filter}%")
-        if user_group_filter:
-            query_parts.append(" AND user_group ILIKE %s")
-            params.append(f"%{user_group_filter}%")
-
-        query_parts.append(" ORDER BY created_at DESC")
-        
-        query_str = " ".join(query_parts)
-        cursor.execute(query_str, params)
-        requisitions = cursor.fetchall()
-        
-        result_list = []
-        for req in requisitions:
-            req_dict = dict(req)
-            if 'created_at' in req_dict and isinstance(req_dict['created_at'], datetime.datetime):
-                req_dict['created_at'] = req_dict['created_at'].isoformat()
-            if 'decision_at' in req_dict and isinstance(req_dict['decision_at'], datetime.datetime):
-                req_dict['decision_at'] = req_dict['decision_at'].isoformat()
-            result_list.append(req_dict)
-
-        return jsonify(result_list), 200
+            if not paginated:
+                # Cheap validator first: unchanged lists are answered with a 304
+                # without running the listing query or serializing anything.
+                etag, last_modified = list_validator(cursor, conditions, params)
+                if request.if_none_match.contains(etag):
+                    return not_modified(etag, last_modified)
+
+            # The keyset cursor needs created_at and id even if not requested,
+            # and a page's validator is built from its ids and updated_at.
+            query, query_params, columns = select_requisitions(
+                fields, conditions, params, ('created_at', 'id', 'updated_at') if paginated else (), search
+            )
+            if paginated:
+                # Fetch one extra row to learn whether another page exists.
+                query += sql.SQL(" LIMIT %s")
+                query_params.append(page_size + 1)
+            cursor.execute(query, query_params)
+            rows = cursor.fetchall()
+
+            if paginated:
+                # Counting the whole filtered set would cost more than the page
+                # itself; the fetched rows alone decide whether the page changed.
+                id_index, updated_at_index = columns.index('id'), columns.index('updated_at')
+                etag, last_modified = page_validator(
+                    request.full_path, [(row[id_index], row[updated_at_index]) for row in rows]
+                )
+                last_modified = utc_timestamp(last_modified, server_timezone(conn))
+                if request.if_none_match.contains(etag):
+                    return not_modified(etag, last_modified)
+
+            next_cursor = None
+            if paginated and len(rows) > page_size:
+                rows = rows[:page_size]
+                last = rows[-1]
+                next_cursor = encode_cursor(
+                    last[columns.index('created_at')], last[columns.index('id')],
+                    last[columns.index('search_rank')] if search else None
+                )
+
+            requisitions = [dict(zip(fields, row)) for row in rows]
+            if paginated:
+                response = jsonify({"requisitions": requisitions, "nextCursor": next_cursor})
+            else:
+                response = jsonify(requisitions)
+            return set_validators(response, etag, last_modified), 200
     except psycopg2.Error as e:
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.route('/api/requisitions/<string:requisition_id>', methods=['PUT'])
-def update_requisition_status(requisition_id):
+def list_validator(cursor, conditions, params):
+    """ETag and Last-Modified for a filtered listing.
+
+    updated_at is bumped by a trigger on every write, so the row count plus
+    the newest updated_at changes whenever the listing does. The query
+    string is mixed in because fields/limit/cursor shape the body.
+    """
+    cursor.execute(
+        "SELECT count(*), max(updated_at) FROM requisitions" + where_clause(conditions),
+        params
+    )
+    row_count, last_modified = cursor.fetchone()
+    validator = f"{request.full_path}|{row_count}|{last_modified.isoformat() if last_modified else ''}"
+    etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+    return etag, utc_timestamp(last_modified, server_timezone(cursor.connection))
+
+def set_validators(response, etag, last_modified):
+    """Adds ETag/Last-Modified and asks clients to revalidate before reusing.
+
+    werkzeug reads naive datetimes as UTC, so pass utc_timestamp() values.
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, last_modified):
+    return set_validators(app.response_class(status=304), etag, last_modified)
+
+@app.route('/api/requisitions/changes', methods=['GET'])
+def get_requisition_changes():
+    """Incremental sync: rows created or changed after the `since` token.
+
+    Without `since` every matching row is returned (initial sync). Rows that
+    changed but no longer match the filters (e.g. a decided requisition on a
+    status=pending_level2 dashboard) and deleted rows are reported in
+    `removed`. Follow `nextToken` while `hasMore` is true, then poll with it.
+    """
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        conditions, params = build_requisition_filters(request.args)
+        page_size = parse_page_size(request.args.get('limit'))
+        since = decode_sync_token(request.args['since']) if request.args.get('since') else None
+    except InvalidQuery as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        # Always the primary: sync tokens assume SYNC_COMMIT_LAG covers every
+        # commit the client hasn't seen, which replica lag would break.
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            query, query_params = select_changes(fields, conditions, params, since, page_size + 1)
+            cursor.execute(query, query_params)
+            rows = cursor.fetchall()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+
+            # Trailing columns are: matches the filters, updated_at, id.
+            changes = [dict(zip(fields, row)) for row in rows if row[-3]]
+            removed = [row[-1] for row in rows if not row[-3]]
+
+            if rows:
+                next_position = (rows[-1][-2], rows[-1][-1])
+            else:
+                next_position = since
+            if not has_more:
+                # Writes still in flight may commit with an updated_at just
+                # before "now"; keep the token behind them so they're not skipped.
+                cursor.execute("SELECT LOCALTIMESTAMP - make_interval(secs => %s)", (SYNC_COMMIT_LAG,))
+                horizon = (cursor.fetchone()[0], '')
+                if since:
+                    next_position = max(min(next_position, horizon), since)
+                else:
+                    next_position = horizon
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    return jsonify({
+        "changes": changes,
+        "removed": removed,
+        "hasMore": has_more,
+        "nextToken": encode_cursor(*next_position)
+    }), 200
+
+@app.route('/api/requisitions/summary', methods=['GET'])
+def get_requisition_summary():
+    """Requisition counts by status, basin and user group for dashboard tiles.
+
+    Read from requisition_counts, which triggers keep current in every
+    writing transaction, so the cost grows with the number of groups rather
+    than the number of requisitions. An optional status narrows every
+    breakdown; requisitions without a basin or user group count under "".
+    """
+    conditions = ["count > 0"]
+    params = []
+    if request.args.get('status'):
+        conditions.append("status = %s")
+        params.append(request.args['status'])
+    try:
+        with read_connection(min_lsn=read_after()) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT status, basin, user_group, count FROM requisition_counts "
+                f"WHERE {' AND '.join(conditions)} ORDER BY status, basin, user_group",
+                params
+            )
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    by_status, by_basin, by_user_group = {}, {}, {}
+    for status, basin, user_group, count in rows:
+        by_status[status] = by_status.get(status, 0) + count
+        by_basin[basin] = by_basin.get(basin, 0) + count
+        by_user_group[user_group] = by_user_group.get(user_group, 0) + count
+    return jsonify({
+        "total": sum(by_status.values()),
+        "byStatus": by_status,
+        "byBasin": by_basin,
+        "byUserGroup": by_user_group,
+        "groups": [
+            {"status": status, "basin": basin, "userGroup": user_group, "count": count}
+            for status, basin, user_group, count in rows
+        ]
+    }), 200
+
+@app.route('/api/requisitions/bulk-status', methods=['POST'])
+def bulk_update_requisition_status():
+    """Applies one level-2 decision to many pending requisitions in a single transaction."""
+    if not g.current_user:
+        return jsonify({"message": "Authentication required"}), 401, {'WWW-Authenticate': token_challenge()}
+    if g.current_user['role'] not in BULK_DECISION_ROLES:
+        return jsonify({"message": "Only level-2 approvers and admins can decide requisitions"}), 403
     data = request.get_json()
+    ids = data.get('ids')
     new_status = data.get('status')
-    approved_by_level2_user_id = data.get('approvedByLevel2UserId')
-    approved_by_level2_user_cpf_id = data.get('approvedByLevel2UserCpfId')
-    approved_by_level2_user_name = data.get('approvedByLevel2UserName')
+    approved_by_level2_user_id = identity_field(data, 'uid', 'approvedByLevel2UserId')
+    approved_by_level2_user_cpf_id = identity_field(data, 'cpfId', 'approvedByLevel2UserCpfId')
+    approved_by_level2_user_name = identity_field(data, 'name', 'approvedByLevel2UserName')
 
-    if not new_status:
-        return jsonify({"message": "New status is required"}), 400
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+        return jsonify({"message": "ids must be a non-empty list of requisition IDs"}), 400
+    if len(ids) > BULK_DECISION_MAX_IDS:
+        return jsonify({"message": f"At most {BULK_DECISION_MAX_IDS} requisitions can be decided per request"}), 400
+    if new_status not in DECISION_STATUSES:
+        return jsonify({"message": f"status must be one of: {', '.join(DECISION_STATUSES)}"}), 400
 
-    conn = None
+    ids = list(dict.fromkeys(ids))  # drop duplicates, keep order
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        decision_timestamp = datetime.datetime.now()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            decision_timestamp = datetime.datetime.now()
 
-        cursor.execute(
-            """
-            UPDATE requisitions
-            SET status = %s,
-                approved_by_level2_user_id = %s,
-                approved_by_level2_user_cpf_id = %s,
-                approved_by_level2_user_name = %s,
-                decision_at = %s
-            WHERE id = %s
-            """,
-            (new_status, approved_by_level2_user_id, approved_by_level2_user_cpf_id,
-             approved_by_level2_user_name, decision_timestamp, requisition_id)
-        )
-        conn.commit()
-        if cursor.rowcount == 0:
-            return jsonify({"message": "Requisition not found"}), 404
-        return jsonify({"message": f"Requisition {requisition_id} status updated to {new_status}"}), 200
+            # Only rows still pending are decided; the status check makes the
+            # operation safe against a concurrent approver.
+            cursor.execute(
+                """
+                UPDATE requisitions
+                SET status = %s,
+                    approved_by_level2_user_id = %s,
+                    approved_by_level2_user_cpf_id = %s,
+                    approved_by_level2_user_name = %s,
+                    decision_at = %s
+                WHERE id = ANY(%s) AND status = %s
+                RETURNING id, requested_by_user_id
+                """,
+                (new_status, approved_by_level2_user_id, approved_by_level2_user_cpf_id,
+                 approved_by_level2_user_name, decision_timestamp, ids, PENDING_STATUS)
+            )
+            updated_rows = cursor.fetchall()
+            updated = {row[0] for row in updated_rows}
+            notify_requisition_events(cursor, [
+                requisition_event('decided', row[0], new_status, row[1]) for row in updated_rows
+            ])
+
+            remaining = [i for i in ids if i not in updated]
+            existing = set()
+            if remaining:
+                cursor.execute("SELECT id FROM requisitions WHERE id = ANY(%s)", (remaining,))
+                existing = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            if updated:
+                record_write(conn)
     except psycopg2.Error as e:
-        if conn:
-            conn.rollback()
         return jsonify({"message": f"Database error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
-@app.route('/api/requisitions/<string:requisition_id>/pdf', methods=['GET'])
-def download_requisition_pdf(requisition_id):
-    conn = None
+    for requisition_id in updated:
+        invalidate_requisition_pdfs(requisition_id)
+
+    results = []
+    for requisition_id in ids:
+        if requisition_id in updated:
+            outcome = 'updated'
+        elif requisition_id in existing:
+            outcome = 'already_decided'
+        else:
+            outcome = 'not_found'
+        results.append({"id": requisition_id, "outcome": outcome})
+
+    return jsonify({
+        "message": f"{len(updated)} of {len(ids)} requisitions updated to {new_status}",
+        "updated": len(updated),
+        "results": results
+    }), 200
+
+@app.route('/api/requisitions/events', methods=['GET'])
+def requisition_events():
+    """Server-Sent Events stream of requisitions being created or decided.
+
+    Events are pushed from PostgreSQL NOTIFY through one LISTEN connection
+    per worker, so idle dashboards cost no queries. Identity comes from the
+    access token (header or ?access_token=). Without one, a role query
+    parameter is only honoured while tokens aren't configured; otherwise an
+    anonymous caller can only follow one userId's requisitions.
+    Each open stream occupies a worker thread, so serve it from threaded or
+    gevent workers rather than the default sync worker.
+    """
+    if g.current_user:
+        role, user_id = g.current_user['role'], g.current_user['uid']
+    elif AUTH_CONFIGURED:
+        role, user_id = None, request.args.get('userId')
+        if not user_id:
+            return jsonify({"message": "An access token or userId is required"}), 400
+    else:
+        role, user_id = request.args.get('role'), request.args.get('userId')
+    if not role and not user_id:
+        return jsonify({"message": "role or userId is required"}), 400
+
+    broker = get_broker()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute("SELECT * FROM requisitions WHERE id = %s", (requisition_id,))
-        requisition = cursor.fetchone()
+        subscription = broker.subscribe(event_filter(role, user_id))
+    except TooManyStreams as e:
+        # EventSource reconnects on its own; spread the retries out.
+        response = jsonify({"message": str(e)})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    response = Response(sse_stream(subscription, broker), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-        if not requisition:
-            return jsonify({"message": "Requisition not found"}), 404
+def stream_requisitions_ndjson(fields, conditions, params, search=None):
+    """Streams matching requisitions as NDJSON, one row per line.
 
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter # Get document dimensions
+    Rows are read from a server-side cursor STREAM_BATCH_SIZE at a time and
+    written out batch by batch, so worker memory stays flat however many rows
+    match. Pagination parameters (limit/cursor) only shape the JSON listing.
+    """
+    min_lsn = read_after()
 
-        # Set title font and draw
-        c.setFont('Helvetica-Bold', 18)
-        # FIX: Changed drawCentredText to drawCentredString
-        c.drawCentredString(width/2, height - 50, "User Data Requisition Form")
+    def generate_batches():
+        with read_connection(min_lsn=min_lsn) as conn:
+            cursor = conn.cursor(name='requisitions_stream')
+            cursor.itersize = STREAM_BATCH_SIZE
+            query, query_params, _ = select_requisitions(fields, conditions, params, search=search)
+            cursor.execute(query, query_params)
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+                yield "".join(app.json.dumps(dict(zip(fields, row))) + "\n" for row in rows)
+            cursor.close()
 
-        # Set content font
-        c.setFont('Helvetica', 10)
-        
-        y_position = height - 80 # Starting Y position for content
-
-        styles = getSampleStyleSheet()
-        normal_style = styles['Normal']
-        bold_style = ParagraphStyle(
-            'Bold',
-            parent=normal_style,
-            fontName='Helvetica-Bold',
-            fontSize=10,
-            leading=12
-        )
+    try:
+        body = prime_stream(generate_batches())
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+    return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+def prime_stream(chunks):
+    """Pulls the first chunk before any headers are sent.
+
+    That way database errors (bad connection, bad query) can still be reported
+    with a 500 instead of a truncated 200.
+    """
+    first_chunk = next(chunks, None)
+
+    def generate():
+        if first_chunk is not None:
+            yield first_chunk
+        yield from chunks
 
-        def add_field(label, value, y_pos):
-            # Format value for display
-            display_value = value.isoformat() if isinstance(value, datetime.datetime) else str(value)
-            
-            # Use Paragraph for better text flow, especially for long remarks
-            # You can adjust width (e.g., 5.5*inch) to control wrapping
-            label_para = Paragraph(f"<b>{label}:</b>", bold_style)
-            value_para = Paragraph(display_value, normal_style)
+    return generate()
 
-            # Draw label
-            label_para.wrapOn(c, 2*inch, 0.5*inch) # Label takes up 2 inches width
-            label_para.drawOn(c, inch, y_pos)
+@app.route('/api/requisitions/export', methods=['GET'])
+def export_requisitions():
+    """Exports the requisitions matching the get_requisitions filters as CSV or XLSX."""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return jsonify({"message": "format must be csv or xlsx"}), 400
+    conditions, params = build_requisition_filters(request.args)
+    filename = f"requisitions_{datetime.date.today().isoformat()}.{export_format}"
 
-            # Draw value - adjust X position
-            value_para.wrapOn(c, 5.5*inch, 0.5*inch) # Value takes up 5.5 inches width
-            value_para.drawOn(c, inch + 2*inch + 0.1*inch, y_pos) # Start value after label + a small gap
+    try:
+        if export_format == 'xlsx':
+            return send_file(
+                xlsx_tempfile(conditions, params),
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                as_attachment=True,
+                download_name=filename
+            )
+        body = prime_stream(stream_csv(conditions, params))
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+    except RuntimeError as e:
+        return jsonify({"message": str(e)}), 500
 
-            # Return new y_pos (approximate, adjust based on content)
-            return y_pos - max(label_para.height, value_para.height) - 5 # 5 is for padding
+    response = Response(body, mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
-        req_dict = dict(requisition)
+@app.route('/api/requisitions/<string:requisition_id>', methods=['PUT'])
+def update_requisition_status(requisition_id):
+    data = request.get_json()
+    new_status = data.get('status')
+    approved_by_level2_user_id = identity_field(data, 'uid', 'approvedByLevel2UserId')
+    approved_by_level2_user_cpf_id = identity_field(data, 'cpfId', 'approvedByLevel2UserCpfId')
+    approved_by_level2_user_name = identity_field(data, 'name', 'approvedByLevel2UserName')
+
+    if not new_status:
+        return jsonify({"message": "New status is required"}), 400
+
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        y_position = add_field("Requisition ID", req_dict.get('id', 'N/A'), y_position)
-        y_position = add_field("Date of Requisition", req_dict.get('requisition_date', 'N/A'), y_position)
-        y_position = add_field("Basin", req_dict.get('basin', 'N/A'), y_position)
-        y_position = add_field("Block", req_dict.get('block', 'N/A'), y_position)
-        y_position = add_field("Area", req_dict.get('area', 'N/A'), y_position)
-        y_position = add_field("2D/3D", req_dict.get('dimension', 'N/A'), y_position)
-        y_position = add_field("Return Date (Data to GMS)", req_dict.get('return_date', 'N/A'), y_position)
-        y_position = add_field("Type of Data Required", req_dict.get('data_type', 'N/A'), y_position)
-        y_position = add_field("Objective", req_dict.get('objective', 'N/A'), y_position)
-        y_position = add_field("Remarks", req_dict.get('remarks', 'N/A'), y_position)
-
-        y_position -= 15 # Add a gap
-        c.setFont('Helvetica-Bold', 14)
-        c.drawString(inch, y_position, "Requested By")
-        y_position -= 15 # Move down after section title
-
-        y_position = add_field("Name", req_dict.get('user_name', 'N/A'), y_position)
-        y_position = add_field("Designation", req_dict.get('user_designation', 'N/A'), y_position)
-        y_position = add_field("CPF No.", req_dict.get('user_cpf_no', 'N/A'), y_position)
-        y_position = add_field("Mobile No.", req_dict.get('user_mobile_no', 'N/A'), y_position)
-        y_position = add_field("Group", req_dict.get('user_group', 'N/A'), y_position)
-
-        y_position -= 15 # Add a gap
-        c.setFont('Helvetica-Bold', 14)
-        c.drawString(inch, y_position, "Approval Details")
-        y_position -= 15 # Move down after section title
-
-        status_display = req_dict.get('status', 'N/A').replace('_', ' ').title()
-        y_position = add_field("Status", status_display, y_position)
-        y_position = add_field("Approved/Denied By", req_dict.get('approved_by_level2_user_name') or req_dict.get('approved_by_level2_user_cpf_id') or 'N/A', y_position)
-        y_position = add_field("Decision Date", req_dict.get('decision_at', 'N/A'), y_position)
-
-
-        c.showPage() # End the current page
-        c.save() # Save the PDF to the buffer
-
-        buffer.seek(0)
-        return send_file(
-            buffer,
+            decision_timestamp = datetime.datetime.now()
+
+            cursor.execute(
+                """
+                UPDATE requisitions
+                SET status = %s,
+                    approved_by_level2_user_id = %s,
+                    approved_by_level2_user_cpf_id = %s,
+                    approved_by_level2_user_name = %s,
+                    decision_at = %s
+                WHERE id = %s
+                RETURNING requested_by_user_id
+                """,
+                (new_status, approved_by_level2_user_id, approved_by_level2_user_cpf_id,
+                 approved_by_level2_user_name, decision_timestamp, requisition_id)
+            )
+            updated_row = cursor.fetchone()
+            if updated_row is None:
+                return jsonify({"message": "Requisition not found"}), 404
+            notify_requisition_events(cursor, [
+                requisition_event('decided', requisition_id, new_status, updated_row[0])
+            ])
+            conn.commit()
+            record_write(conn)
+            invalidate_requisition_pdfs(requisition_id)
+            return jsonify({"message": f"Requisition {requisition_id} status updated to {new_status}"}), 200
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+def fetch_requisition(requisition_id, columns=ALL_REQUISITION_COLUMNS):
+    """Loads one requisition row as a dict, or None when it doesn't exist."""
+    with read_connection(min_lsn=read_after()) as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute(f"SELECT {columns} FROM requisitions WHERE id = %s", (requisition_id,))
+        requisition = cursor.fetchone()
+        return dict(requisition) if requisition else None
+
+@app.route('/api/requisitions/<string:requisition_id>/pdf', methods=['GET'])
+def download_requisition_pdf(requisition_id):
+    # Only the columns that identify the rendering are read up front: they
+    # are enough for a 304 or a cache hit. The connection is returned before
+    # any rendering starts.
+    try:
+        version = fetch_requisition(requisition_id, PDF_VERSION_COLUMNS)
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+    if not version:
+        return jsonify({"message": "Requisition not found"}), 404
+
+    key = cache_key(version)
+    last_modified = utc_timestamp(version['decision_at'])
+    if request.if_none_match.contains(key):
+        return not_modified(key, last_modified)
+
+    try:
+        pdf_path = cached_pdf(requisition_id, key)
+        if not pdf_path:
+            req_dict = fetch_requisition(requisition_id)
+            if not req_dict:
+                return jsonify({"message": "Requisition not found"}), 404
+            future = submit_render(req_dict)
+            try:
+                pdf_path = future.result(timeout=PDF_RENDER_WAIT)
+            except FutureTimeoutError:
+                return jsonify({
+                    "message": "PDF is being generated, poll the status URL and retry the download when it is ready",
+                    "status": "rendering",
+                    "statusUrl": f"/api/requisitions/{requisition_id}/pdf/status"
+                }), 202
+
+        response = send_file(
+            pdf_path,
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=f"requisition_{requisition_id}.pdf"
+            download_name=f"requisition_{requisition_id}.pdf",
+            etag=key,
+            last_modified=last_modified
         )
-    except psycopg2.Error as e:
-        return jsonify({"message": f"Database error: {str(e)}"}), 500
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         # Catch any other general exceptions during PDF generation
         print(f"Error during PDF generation: {e}")
         return jsonify({"message": f"PDF generation error: {str(e)}"}), 500
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/api/requisitions/<string:requisition_id>/pdf/status', methods=['GET'])
+def get_requisition_pdf_status(requisition_id):
+    try:
+        req_dict = fetch_requisition(requisition_id)
+    except psycopg2.Error as e:
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+    if not req_dict:
+        return jsonify({"message": "Requisition not found"}), 404
+
+    status, error = render_status(req_dict)
+    body = {"status": status, "downloadUrl": f"/api/requisitions/{requisition_id}/pdf"}
+    if error:
+        body["message"] = f"PDF generation error: {error}"
+    return jsonify(body), 200
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
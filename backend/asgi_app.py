@@ -0,0 +1,584 @@
+"""Async variant of the API for an ASGI server.
+
+Serves the interactive routes (login, logout, register, users, password
+change, requisition create/list/decide, bulk decisions and the PDF download) from one event
+loop on asyncpg, so a single process can keep thousands of slow clients
+open without a thread or worker each:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8000 --workers 2
+
+Password hashing and ReportLab stay off the event loop: hashing runs on the
+bounded pool in passwords.py (reached through a thread so the loop never
+blocks on its queue), PDFs on the process pool in pdf_render.py. Bulk import,
+export, incremental changes and the event stream remain on the Flask app
+(app.py), which shares the same database, cache directory and tokens.
+"""
+import os
+import re
+import uuid
+import asyncio
+import hashlib
+import datetime
+import itertools
+import contextlib
+from email.utils import format_datetime
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, Response
+from starlette.routing import Route
+
+from auth import ACCESS_TOKEN_TTL, REQUIRE_AUTH_TOKEN, InvalidToken, issue_token, verify_token, revoke_token, bearer_token, token_challenge
+from db import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_TIMEOUT
+from events import EVENTS_CHANNEL, requisition_event
+from json_provider import dumps_bytes
+from passwords import HashingBusy, hash_password, verify_password, needs_rehash
+from pdf_render import cache_key, cached_pdf, submit_render, render_status, invalidate_requisition_pdfs
+from requisitions import (
+    INSERT_COLUMNS, REQUISITION_COLUMNS, PENDING_STATUS, DECISION_STATUSES, BULK_DECISION_ROLES,
+    BULK_DECISION_MAX_IDS, SEARCH_RANK, InvalidQuery, build_requisition_filters, search_terms,
+    where_clause, is_paginated, parse_page_size, encode_cursor, keyset_condition, page_validator, parse_fields,
+    build_requisition_data, missing_mandatory_field, utc_timestamp,
+)
+
+# One process multiplexes many requests, so it can use more connections than
+# a sync worker; keep workers * ASYNC_DB_POOL_MAX_SIZE under max_connections.
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 20))
+# Seconds a download request waits for a fresh render before answering 202.
+PDF_RENDER_WAIT = float(os.environ.get('PDF_RENDER_WAIT', 5))
+PDF_VERSION_COLUMNS = "id, status, decision_at"
+# Every column of a requisition, leaving out the derived search_vector.
+ALL_REQUISITION_COLUMNS = ", ".join(REQUISITION_COLUMNS)
+# Columns whose values arrive as ISO strings and are parsed by PostgreSQL.
+_DATE_COLUMNS = {'requisition_date', 'return_date'}
+
+INSERT_SQL = "INSERT INTO requisitions ({}) VALUES ({})".format(
+    ', '.join(INSERT_COLUMNS),
+    ', '.join(f"${n}::text::date" if column in _DATE_COLUMNS else f"${n}"
+              for n, column in enumerate(INSERT_COLUMNS, 1)),
+)
+
+
+class JSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content):
+        return dumps_bytes(content)
+
+
+def message(text, status_code):
+    return JSONResponse({"message": text}, status_code=status_code)
+
+
+def numbered(query):
+    """Rewrites psycopg2-style %s placeholders as asyncpg's $1, $2, ..."""
+    counter = itertools.count(1)
+    return re.sub(r'%s', lambda _: f"${next(counter)}", query)
+
+
+async def json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Request body must be valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(400, "Request body must be a JSON object")
+    return data
+
+
+def current_user(request):
+    """Claims of the bearer token, None without one (see REQUIRE_AUTH_TOKEN)."""
+    token = bearer_token(request.headers.get('Authorization'))
+    if token:
+        try:
+            return verify_token(token)
+        except InvalidToken as e:
+            # As in the Flask app: where a token is optional, an expired or
+            # foreign one just leaves the caller anonymous.
+            if REQUIRE_AUTH_TOKEN:
+                raise HTTPException(401, str(e), {'WWW-Authenticate': token_challenge('invalid_token')})
+            return None
+    if REQUIRE_AUTH_TOKEN:
+        raise HTTPException(401, "Authentication required", {'WWW-Authenticate': token_challenge()})
+    return None
+
+
+def identity_field(user, data, claim, body_key, default=None):
+    """Identity of the caller: the token's claim when authenticated, else the legacy body field."""
+    if user:
+        return user[claim]
+    return data.get(body_key, default)
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix('W/').strip('"') for value in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def validator_headers(etag, last_modified):
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if last_modified:
+        # Callers pass aware datetimes (see utc_timestamp).
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(datetime.timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified(etag, last_modified):
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+async def run_blocking(fn, *args):
+    """Runs a blocking call (password hashing) on a thread, off the event loop."""
+    return await asyncio.to_thread(fn, *args)
+
+
+def pool(request):
+    return request.app.state.pool
+
+
+async def notify(connection, events):
+    """Queues requisition NOTIFYs in the current transaction, as events.notify_requisition_events does."""
+    await connection.execute(
+        "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+        EVENTS_CHANNEL, [dumps_bytes(event).decode('utf-8') for event in events]
+    )
+
+
+async def home(request):
+    return JSONResponse({"message": "Welcome to the Flask API!"})
+
+
+async def login(request):
+    data = await json_body(request)
+    cpf_id = data.get('cpfId')
+    password = data.get('password')
+    if not cpf_id or not password:
+        return message("CPF ID and password are required", 400)
+
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        user = await connection.fetchrow(
+            "SELECT id, cpf_id, name, role, password_hash FROM users WHERE cpf_id = $1", cpf_id
+        )
+    # The hash check runs after the connection is back in the pool.
+    if not user or not await run_blocking(verify_password, user['password_hash'], password):
+        return message("Invalid CPF ID or password", 401)
+
+    if needs_rehash(user['password_hash']):
+        await upgrade_password_hash(request, user['id'], user['password_hash'], password)
+
+    return JSONResponse({
+        "message": "Login successful",
+        "cpfId": user['cpf_id'],
+        "uid": user['id'],
+        "name": user['name'],
+        "role": user['role'],
+        "token": issue_token(user),
+        "tokenType": "Bearer",
+        "expiresIn": ACCESS_TOKEN_TTL
+    })
+
+
+async def upgrade_password_hash(request, user_id, old_hash, password):
+    """Re-hashes a verified password with the current PASSWORD_HASH_METHOD, best effort."""
+    try:
+        new_hash = await run_blocking(hash_password, password)
+        async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+            await connection.execute(
+                "UPDATE users SET password_hash = $1 WHERE id = $2 AND password_hash = $3",
+                new_hash, user_id, old_hash
+            )
+    except (HashingBusy, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+        print(f"Password rehash skipped for user {user_id}: {e}")
+
+
+async def logout(request):
+    user = current_user(request)
+    if not user:
+        return message("No access token supplied", 400)
+    revoke_token(user)
+    return message("Logged out", 200)
+
+
+async def register_user(request):
+    user = current_user(request)
+    data = await json_body(request)
+    name = data.get('name')
+    cpf_id = data.get('cpfId')
+    password = data.get('password')
+    role = data.get('role')
+    created_by = identity_field(user, data, 'cpfId', 'createdBy', 'unknown')
+
+    if not all([name, cpf_id, password, role]):
+        return message("Name, CPF ID, password, and role are required", 400)
+    if len(password) < 6:
+        return message("Password must be at least 6 characters long", 400)
+
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        if await connection.fetchval("SELECT id FROM users WHERE cpf_id = $1", cpf_id):
+            return message("User with this CPF ID already exists", 409)
+
+    user_id = str(uuid.uuid4())
+    hashed_password = await run_blocking(hash_password, password)
+    try:
+        async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+            await connection.execute(
+                """INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
+                VALUES ($1, $2, $3, $4, $5, $6)""",
+                user_id, cpf_id, name, hashed_password, role, created_by
+            )
+    except asyncpg.UniqueViolationError:
+        return message("User with this CPF ID already exists", 409)
+    return JSONResponse({"message": "User registered successfully", "userId": user_id}, status_code=201)
+
+
+async def get_users(request):
+    current_user(request)
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        users = await connection.fetch(
+            "SELECT id, cpf_id, name, role, created_at, created_by FROM users ORDER BY created_at DESC"
+        )
+    return JSONResponse([dict(user) for user in users])
+
+
+async def change_password(request):
+    current_user(request)
+    user_id = request.path_params['user_id']
+    data = await json_body(request)
+    current_password = data.get('currentPassword')
+    new_password = data.get('newPassword')
+
+    if not current_password or not new_password:
+        return message("Current and new passwords are required", 400)
+    if len(new_password) < 6:
+        return message("New password must be at least 6 characters long", 400)
+
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        user = await connection.fetchrow("SELECT id, password_hash FROM users WHERE id = $1", user_id)
+    if not user:
+        return message("User not found", 404)
+    if not await run_blocking(verify_password, user['password_hash'], current_password):
+        return message("Incorrect current password", 400)
+    if await run_blocking(verify_password, user['password_hash'], new_password):
+        return message("New password cannot be the same as current password", 400)
+
+    hashed_new_password = await run_blocking(hash_password, new_password)
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        await connection.execute("UPDATE users SET password_hash = $1 WHERE id = $2", hashed_new_password, user_id)
+    return message("Password changed successfully", 200)
+
+
+async def create_requisition(request):
+    user = current_user(request)
+    data = await json_body(request)
+    requisition_data = build_requisition_data(
+        data,
+        requested_by_user_id=identity_field(user, data, 'uid', 'requestedByUserId'),
+        requested_by_user_cpf_id=identity_field(user, data, 'cpfId', 'requestedByUserCpfId'),
+    )
+    missing_message = missing_mandatory_field(requisition_data)
+    if missing_message:
+        return message(missing_message, 400)
+
+    requisition_data['id'] = str(uuid.uuid4())
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        async with connection.transaction():
+            await connection.execute(INSERT_SQL, *(requisition_data[column] for column in INSERT_COLUMNS))
+            await notify(connection, [
+                requisition_event('created', requisition_data['id'], requisition_data['status'],
+                                  requisition_data['requested_by_user_id'])
+            ])
+    return JSONResponse({"message": "Requisition created successfully", "id": requisition_data['id']},
+                        status_code=201)
+
+
+async def get_requisitions(request):
+    current_user(request)
+    args = request.query_params
+    paginated = is_paginated(args)
+    search = search_terms(args)
+    try:
+        fields = parse_fields(args.get('fields'))
+        conditions, params = build_requisition_filters(args)
+        if paginated:
+            page_size = parse_page_size(args.get('limit'))
+            if args.get('cursor'):
+                condition, cursor_params = keyset_condition(args['cursor'], search)
+                conditions.append(condition)
+                params.extend(cursor_params)
+    except InvalidQuery as e:
+        return message(str(e), 400)
+
+    # parse_fields only returns known column names, so they can be quoted here.
+    extra_columns = ('created_at', 'id', 'updated_at') if paginated else ()
+    columns = fields + [column for column in extra_columns if column not in fields]
+    selected = ', '.join(f'"{column}"' for column in columns)
+    order = "created_at DESC, id DESC"
+    query_params = list(params)
+    if search:
+        # Same ranking as select_requisitions: best match first.
+        selected += f", {SEARCH_RANK} AS search_rank"
+        order = "search_rank DESC, " + order
+        query_params.insert(0, search)
+    query = f"SELECT {selected} FROM requisitions{where_clause(conditions)} ORDER BY {order}"
+    if paginated:
+        # Fetch one extra row to learn whether another page exists.
+        query += " LIMIT %s"
+
+    full_path = f"{request.url.path}?{request.url.query}"
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        server_timezone = connection.get_settings().TimeZone
+        if not paginated:
+            row_count, last_modified = await connection.fetchrow(
+                numbered("SELECT count(*), max(updated_at) FROM requisitions" + where_clause(conditions)), *params
+            )
+            validator = f"{full_path}|{row_count}|{last_modified.isoformat() if last_modified else ''}"
+            etag = hashlib.sha1(validator.encode('utf-8')).hexdigest()
+            last_modified = utc_timestamp(last_modified, server_timezone)
+            if etag_matches(request, etag):
+                return not_modified(etag, last_modified)
+        rows = await connection.fetch(numbered(query), *query_params, *([page_size + 1] if paginated else []))
+
+    if paginated:
+        # Same as the Flask app: a page's tag comes from the rows it fetched.
+        etag, last_modified = page_validator(full_path, [(row['id'], row['updated_at']) for row in rows])
+        last_modified = utc_timestamp(last_modified, server_timezone)
+        if etag_matches(request, etag):
+            return not_modified(etag, last_modified)
+
+    next_cursor = None
+    if paginated and len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'], rows[-1]['search_rank'] if search else None)
+    requisitions = [{field: row[field] for field in fields} for row in rows]
+    body = {"requisitions": requisitions, "nextCursor": next_cursor} if paginated else requisitions
+    return JSONResponse(body, headers=validator_headers(etag, last_modified))
+
+
+async def update_requisition_status(request):
+    user = current_user(request)
+    requisition_id = request.path_params['requisition_id']
+    data = await json_body(request)
+    new_status = data.get('status')
+    if not new_status:
+        return message("New status is required", 400)
+
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        async with connection.transaction():
+            requested_by_user_id = await connection.fetchrow(
+                """
+                UPDATE requisitions
+                SET status = $1,
+                    approved_by_level2_user_id = $2,
+                    approved_by_level2_user_cpf_id = $3,
+                    approved_by_level2_user_name = $4,
+                    decision_at = $5
+                WHERE id = $6
+                RETURNING requested_by_user_id
+                """,
+                new_status,
+                identity_field(user, data, 'uid', 'approvedByLevel2UserId'),
+                identity_field(user, data, 'cpfId', 'approvedByLevel2UserCpfId'),
+                identity_field(user, data, 'name', 'approvedByLevel2UserName'),
+                datetime.datetime.now(), requisition_id
+            )
+            if requested_by_user_id is None:
+                return message("Requisition not found", 404)
+            await notify(connection, [
+                requisition_event('decided', requisition_id, new_status, requested_by_user_id[0])
+            ])
+    invalidate_requisition_pdfs(requisition_id)
+    return message(f"Requisition {requisition_id} status updated to {new_status}", 200)
+
+
+async def bulk_update_requisition_status(request):
+    """Applies one level-2 decision to many pending requisitions, as the Flask route does."""
+    user = current_user(request)
+    if not user:
+        raise HTTPException(401, "Authentication required", {'WWW-Authenticate': token_challenge()})
+    if user['role'] not in BULK_DECISION_ROLES:
+        return message("Only level-2 approvers and admins can decide requisitions", 403)
+    data = await json_body(request)
+    ids = data.get('ids')
+    new_status = data.get('status')
+
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+        return message("ids must be a non-empty list of requisition IDs", 400)
+    if len(ids) > BULK_DECISION_MAX_IDS:
+        return message(f"At most {BULK_DECISION_MAX_IDS} requisitions can be decided per request", 400)
+    if new_status not in DECISION_STATUSES:
+        return message(f"status must be one of: {', '.join(DECISION_STATUSES)}", 400)
+
+    ids = list(dict.fromkeys(ids))  # drop duplicates, keep order
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        async with connection.transaction():
+            # Only rows still pending are decided, so a concurrent approver wins cleanly.
+            updated_rows = await connection.fetch(
+                """
+                UPDATE requisitions
+                SET status = $1,
+                    approved_by_level2_user_id = $2,
+                    approved_by_level2_user_cpf_id = $3,
+                    approved_by_level2_user_name = $4,
+                    decision_at = $5
+                WHERE id = ANY($6) AND status = $7
+                RETURNING id, requested_by_user_id
+                """,
+                new_status, user['uid'], user['cpfId'], user['name'], datetime.datetime.now(), ids, PENDING_STATUS
+            )
+            updated = {row['id'] for row in updated_rows}
+            if updated_rows:
+                await notify(connection, [
+                    requisition_event('decided', row['id'], new_status, row['requested_by_user_id'])
+                    for row in updated_rows
+                ])
+            remaining = [i for i in ids if i not in updated]
+            existing = set()
+            if remaining:
+                existing = {row['id'] for row in await connection.fetch(
+                    "SELECT id FROM requisitions WHERE id = ANY($1)", remaining
+                )}
+
+    for requisition_id in updated:
+        invalidate_requisition_pdfs(requisition_id)
+
+    results = []
+    for requisition_id in ids:
+        if requisition_id in updated:
+            outcome = 'updated'
+        elif requisition_id in existing:
+            outcome = 'already_decided'
+        else:
+            outcome = 'not_found'
+        results.append({"id": requisition_id, "outcome": outcome})
+    return JSONResponse({
+        "message": f"{len(updated)} of {len(ids)} requisitions updated to {new_status}",
+        "updated": len(updated),
+        "results": results,
+    })
+
+
+async def fetch_requisition(request, requisition_id, columns=ALL_REQUISITION_COLUMNS):
+    async with pool(request).acquire(timeout=DB_POOL_TIMEOUT) as connection:
+        row = await connection.fetchrow(f"SELECT {columns} FROM requisitions WHERE id = $1", requisition_id)
+    return dict(row) if row else None
+
+
+async def download_requisition_pdf(request):
+    current_user(request)
+    requisition_id = request.path_params['requisition_id']
+    version = await fetch_requisition(request, requisition_id, PDF_VERSION_COLUMNS)
+    if not version:
+        return message("Requisition not found", 404)
+
+    key = cache_key(version)
+    last_modified = utc_timestamp(version['decision_at'])
+    if etag_matches(request, key):
+        return not_modified(key, last_modified)
+
+    pdf_path = cached_pdf(requisition_id, key)
+    if not pdf_path:
+        req_dict = await fetch_requisition(request, requisition_id)
+        if not req_dict:
+            return message("Requisition not found", 404)
+        try:
+            # Shielded so a timeout here doesn't cancel the render itself.
+            pdf_path = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(submit_render(req_dict))),
+                                              PDF_RENDER_WAIT)
+        except asyncio.TimeoutError:
+            return JSONResponse({
+                "message": "PDF is being generated, poll the status URL and retry the download when it is ready",
+                "status": "rendering",
+                "statusUrl": f"/api/requisitions/{requisition_id}/pdf/status"
+            }, status_code=202)
+        except Exception as e:
+            print(f"Error during PDF generation: {e}")
+            return message(f"PDF generation error: {str(e)}", 500)
+
+    return FileResponse(
+        pdf_path,
+        media_type='application/pdf',
+        filename=f"requisition_{requisition_id}.pdf",
+        headers=validator_headers(key, last_modified),
+    )
+
+
+async def get_requisition_pdf_status(request):
+    current_user(request)
+    requisition_id = request.path_params['requisition_id']
+    req_dict = await fetch_requisition(request, requisition_id)
+    if not req_dict:
+        return message("Requisition not found", 404)
+    status, error = render_status(req_dict)
+    body = {"status": status, "downloadUrl": f"/api/requisitions/{requisition_id}/pdf"}
+    if error:
+        body["message"] = f"PDF generation error: {error}"
+    return JSONResponse(body)
+
+
+async def handle_http_exception(request, exc):
+    response = message(exc.detail, exc.status_code)
+    response.headers.update(exc.headers or {})
+    return response
+
+
+async def handle_hashing_busy(request, exc):
+    response = message(str(exc), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+async def handle_pool_timeout(request, exc):
+    response = message("No database connection available, please retry shortly", 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+async def handle_database_error(request, exc):
+    return message(f"Database error: {str(exc)}", 500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    if not DATABASE_URL:
+        raise Exception("DATABASE_URL environment variable is not set.")
+    app.state.pool = await asyncpg.create_pool(
+        DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=ASYNC_DB_POOL_MAX_SIZE
+    )
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/', home, methods=['GET']),
+        Route('/api/login', login, methods=['POST']),
+        Route('/api/logout', logout, methods=['POST']),
+        Route('/api/register', register_user, methods=['POST']),
+        Route('/api/users', get_users, methods=['GET']),
+        Route('/api/users/{user_id}/password', change_password, methods=['PUT']),
+        Route('/api/requisitions', create_requisition, methods=['POST']),
+        Route('/api/requisitions', get_requisitions, methods=['GET']),
+        Route('/api/requisitions/bulk-status', bulk_update_requisition_status, methods=['POST']),
+        Route('/api/requisitions/{requisition_id}', update_requisition_status, methods=['PUT']),
+        Route('/api/requisitions/{requisition_id}/pdf', download_requisition_pdf, methods=['GET']),
+        Route('/api/requisitions/{requisition_id}/pdf/status', get_requisition_pdf_status, methods=['GET']),
+    ],
+    # IMPORTANT: For production, replace "*" with your frontend URL, as in app.py.
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                          expose_headers=['WWW-Authenticate'])],
+    exception_handlers={
+        HTTPException: handle_http_exception,
+        HashingBusy: handle_hashing_busy,
+        asyncio.TimeoutError: handle_pool_timeout,
+        asyncpg.PostgresError: handle_database_error,
+    },
+    lifespan=lifespan,
+)
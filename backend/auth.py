@@ -0,0 +1,103 @@
+import os
+import time
+import uuid
+import secrets
+import threading
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', 8 * 60 * 60))
+# When set, every route except the public ones rejects requests without a token.
+REQUIRE_AUTH_TOKEN = os.environ.get('REQUIRE_AUTH_TOKEN', '').lower() in ('1', 'true', 'yes')
+
+# Signing key shared by every worker. Without it each process makes up its own
+# key, so tokens only verify in the worker that issued them and none survive
+# a restart; that is only tolerable while tokens are optional.
+SECRET_KEY = os.environ.get('SECRET_KEY')
+# Whether this deployment relies on tokens for identity, so unauthenticated
+# claims (e.g. a role in a query string) must not be trusted.
+AUTH_CONFIGURED = REQUIRE_AUTH_TOKEN or bool(SECRET_KEY)
+if not SECRET_KEY:
+    if REQUIRE_AUTH_TOKEN:
+        raise RuntimeError("SECRET_KEY must be set when REQUIRE_AUTH_TOKEN is on")
+    print("SECRET_KEY is not set; using a random per-process key for access tokens.")
+    SECRET_KEY = secrets.token_urlsafe(32)
+
+_serializer = URLSafeTimedSerializer(SECRET_KEY, salt='access-token')
+
+
+class InvalidToken(Exception):
+    """Raised for tokens that are malformed, tampered with, expired or revoked."""
+
+
+class RevocationCache:
+    """In-process set of revoked token ids, each kept until the token would expire."""
+
+    def __init__(self):
+        self._revoked = {}  # jti -> unix time after which the entry can be dropped
+        self._lock = threading.Lock()
+
+    def revoke(self, jti, expires_at):
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self._prune(time.time())
+
+    def is_revoked(self, jti):
+        # Plain dict lookup, no lock needed on the hot path.
+        return jti in self._revoked
+
+    def _prune(self, now):
+        for jti in [jti for jti, expires_at in self._revoked.items() if expires_at < now]:
+            del self._revoked[jti]
+
+
+revocations = RevocationCache()
+
+
+def issue_token(user):
+    """Signs an access token carrying the identity returned by /api/login."""
+    claims = {
+        'uid': user['id'],
+        'cpfId': user['cpf_id'],
+        'name': user['name'],
+        'role': user['role'],
+        'jti': uuid.uuid4().hex,
+    }
+    return _serializer.dumps(claims)
+
+
+def verify_token(token):
+    """Returns the token's claims without touching the database."""
+    try:
+        claims, issued_at = _serializer.loads(token, max_age=ACCESS_TOKEN_TTL, return_timestamp=True)
+    except SignatureExpired:
+        raise InvalidToken("Access token has expired")
+    except BadSignature:
+        raise InvalidToken("Invalid access token")
+    if revocations.is_revoked(claims.get('jti')):
+        raise InvalidToken("Access token has been revoked")
+    claims['exp'] = issued_at.timestamp() + ACCESS_TOKEN_TTL
+    return claims
+
+
+def revoke_token(claims):
+    revocations.revoke(claims['jti'], claims['exp'])
+
+
+def token_challenge(error=None):
+    """WWW-Authenticate value for a 401 caused by the access token itself.
+
+    Clients can tell these apart from other 401s (e.g. a failed login) and
+    only then discard their session.
+    """
+    return f'Bearer error="{error}"' if error else 'Bearer'
+
+
+def bearer_token(authorization_header):
+    """Extracts the token from an 'Authorization: Bearer <token>' header."""
+    if not authorization_header:
+        return None
+    scheme, _, token = authorization_header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
@@ -0,0 +1,402 @@
+"""Benchmark harness for the API routes.
+
+Seeds a disposable PostgreSQL database with synthetic users and
+requisitions, drives the Flask app in-process and writes latency
+percentiles and throughput per route as JSON, so runs can be compared to
+catch regressions:
+
+    BENCHMARK_DATABASE_URL=postgresql://localhost/requisitions_bench \\
+        python benchmark.py run --sizes 10000,100000 --output after.json --compare before.json
+
+The database is modified (seeded, truncated when the size changes), so
+never point it at real data.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import shutil
+import platform
+import tempfile
+import datetime
+import itertools
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+BENCHMARK_PASSWORD = 'benchmark'
+BASINS = ['Krishna Godavari', 'Cauvery', 'Mumbai Offshore', 'Assam Shelf', 'Cambay', 'Rajasthan']
+USER_GROUPS = ['Exploration', 'Geophysics', 'Reservoir', 'Drilling', 'Data Management']
+FILTERS = {
+    'status': 'pending_level2',
+    'userId': 'bench-user-7',
+    'basin': 'Cauvery',
+    'userGroup': 'Geo',
+}
+SEED_BATCH_SIZE = 100000
+
+_SEED_REQUISITIONS_SQL = """
+    INSERT INTO requisitions (
+        id, title, description, requisition_date, basin, block, area, dimension, return_date,
+        data_type, objective, remarks, user_name, user_designation, user_cpf_no, user_mobile_no,
+        user_group, requested_by_user_id, requested_by_user_cpf_id, status, created_at,
+        approved_by_level2_user_id, approved_by_level2_user_cpf_id, approved_by_level2_user_name, decision_at
+    )
+    SELECT
+        md5('bench-req-' || n)::uuid::text,
+        'Requisition ' || n,
+        'Synthetic requisition number ' || n || ' generated for benchmarking',
+        CURRENT_DATE - (n %% 365),
+        (%(basins)s::text[])[1 + n %% %(basin_count)s],
+        'Block ' || (n %% 50),
+        'Area ' || (n %% 20),
+        '2D',
+        CURRENT_DATE + 30,
+        'Seismic',
+        'Benchmark',
+        NULL,
+        'Bench User ' || (1 + n %% %(users)s),
+        'Geologist',
+        'bench' || (1 + n %% %(users)s),
+        '9000000000',
+        (%(user_groups)s::text[])[1 + n %% %(user_group_count)s],
+        'bench-user-' || (1 + n %% %(users)s),
+        'bench' || (1 + n %% %(users)s),
+        status,
+        LOCALTIMESTAMP - make_interval(secs => n),
+        CASE WHEN status <> 'pending_level2' THEN 'bench-user-10' END,
+        CASE WHEN status <> 'pending_level2' THEN 'bench10' END,
+        CASE WHEN status <> 'pending_level2' THEN 'Bench User 10' END,
+        CASE WHEN status <> 'pending_level2' THEN LOCALTIMESTAMP - make_interval(secs => n) + interval '1 day' END
+    FROM generate_series(%(start)s, %(stop)s) AS n,
+         LATERAL (SELECT (ARRAY['pending_level2', 'approved_level2', 'denied_level2'])[1 + (n / 7) %% 3] AS status) s
+"""
+
+
+def requisition_id(n):
+    """Id of the n-th seeded requisition, matching md5('bench-req-' || n)::uuid."""
+    digest = hashlib.md5(f"bench-req-{n}".encode('utf-8')).hexdigest()
+    return f"{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:]}"
+
+
+def pending_numbers(size, count):
+    """Seed numbers of `count` requisitions that were seeded as pending."""
+    return list(itertools.islice((n for n in range(1, size + 1) if (n // 7) % 3 == 0), count))
+
+
+def seed(conn, size, password_hash, reseed=False):
+    """Makes the database hold exactly `size` seeded requisitions."""
+    users = max(size // 100, 100)
+    cursor = conn.cursor()
+    cursor.execute("SELECT count(*) FROM requisitions")
+    if cursor.fetchone()[0] == size and not reseed:
+        return False
+
+    click.echo(f"Seeding {size} requisitions and {users} users...")
+    started = time.perf_counter()
+    cursor.execute("TRUNCATE requisitions, requisition_tombstones")
+    cursor.execute("DELETE FROM users WHERE created_by = 'benchmark'")
+    cursor.execute(
+        """
+        INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
+        SELECT 'bench-user-' || n, 'bench' || n, 'Bench User ' || n, %s,
+               CASE WHEN n %% 10 = 0 THEN 'level2' ELSE 'level1' END, 'benchmark'
+        FROM generate_series(1, %s) AS n
+        """,
+        (password_hash, users)
+    )
+    conn.commit()
+    for start in range(1, size + 1, SEED_BATCH_SIZE):
+        cursor.execute(_SEED_REQUISITIONS_SQL, {
+            'basins': BASINS, 'basin_count': len(BASINS),
+            'user_groups': USER_GROUPS, 'user_group_count': len(USER_GROUPS),
+            'users': users, 'start': start, 'stop': min(start + SEED_BATCH_SIZE - 1, size),
+        })
+        conn.commit()
+    conn.autocommit = True
+    cursor.execute("VACUUM ANALYZE requisitions")
+    cursor.execute("VACUUM ANALYZE users")
+    conn.autocommit = False
+    click.echo(f"Seeded in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, wall_seconds):
+    latencies = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughputRps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'meanMs': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50Ms': ms(percentile(latencies, 50)),
+        'p95Ms': ms(percentile(latencies, 95)),
+        'p99Ms': ms(percentile(latencies, 99)),
+        'maxMs': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_scenario(app, request_fn, iterations, concurrency, warmup):
+    """Calls request_fn(client, i) `iterations` times and returns its summary.
+
+    request_fn returns True when the response was the expected one.
+    """
+    local = threading.local()
+    latencies = []
+    errors = 0
+    errors_lock = threading.Lock()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    def call(i):
+        nonlocal errors
+        started = time.perf_counter()
+        ok = request_fn(client(), i)
+        latencies.append(time.perf_counter() - started)
+        if not ok:
+            with errors_lock:
+                errors += 1
+
+    for i in range(warmup):
+        request_fn(client(), -1 - i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(iterations)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def build_scenarios(size, auth_headers, iterations, warmup):
+    """Returns [(name, request_fn)] for every benchmarked route."""
+    users = max(size // 100, 100)
+    rng = random.Random(size)
+    created_ids = []
+    pending = [requisition_id(n) for n in pending_numbers(size, iterations + warmup)]
+    pdf_ids = [requisition_id(n) for n in range(1, iterations + warmup + 1)]
+
+    def login(client, i):
+        user = rng.randint(1, users)
+        response = client.post('/api/login', json={'cpfId': f"bench{user}", 'password': BENCHMARK_PASSWORD})
+        return response.status_code == 200
+
+    def create_requisition(client, i):
+        response = client.post('/api/requisitions', headers=auth_headers, json={
+            'title': f"Benchmark {i}", 'description': 'Created by the benchmark',
+            'basin': rng.choice(BASINS), 'userGroup': rng.choice(USER_GROUPS),
+            'userCPFNo': 'bench1', 'userMobileNo': '9000000000', 'userName': 'Bench User 1',
+            'requestedByUserId': 'bench-user-1', 'requestedByUserCpfId': 'bench1',
+        })
+        if response.status_code == 201:
+            created_ids.append(response.get_json()['id'])
+            return True
+        return False
+
+    def update_requisition_status(client, i):
+        response = client.put(f"/api/requisitions/{pending[i]}", headers=auth_headers, json={
+            'status': 'approved_level2', 'approvedByLevel2UserId': 'bench-user-10',
+            'approvedByLevel2UserCpfId': 'bench10', 'approvedByLevel2UserName': 'Bench User 10',
+        })
+        return response.status_code == 200
+
+    def download_requisition_pdf(client, i):
+        response = client.get(f"/api/requisitions/{pdf_ids[i]}/pdf", headers=auth_headers)
+        response.close()
+        return response.status_code == 200
+
+    scenarios = [
+        ('login', login),
+        ('create_requisition', create_requisition),
+    ]
+    for count in range(len(FILTERS) + 1):
+        for combo in itertools.combinations(FILTERS, count):
+            query = {key: FILTERS[key] for key in combo}
+            query['limit'] = 50
+
+            def get_requisitions(client, i, query=query):
+                return client.get('/api/requisitions', query_string=query, headers=auth_headers).status_code == 200
+
+            scenarios.append((f"get_requisitions[{'+'.join(combo) or 'all'}]", get_requisitions))
+    scenarios += [
+        ('update_requisition_status', update_requisition_status),
+        ('download_requisition_pdf', download_requisition_pdf),
+        # Same ids again: now served from the on-disk PDF cache.
+        ('download_requisition_pdf[cached]', download_requisition_pdf),
+    ]
+    return scenarios, created_ids, pending
+
+
+def restore(conn, created_ids, decided_ids):
+    """Undoes the benchmark's writes so the next run can reuse the seed."""
+    cursor = conn.cursor()
+    if created_ids:
+        cursor.execute("DELETE FROM requisitions WHERE id = ANY(%s)", (created_ids,))
+        cursor.execute("DELETE FROM requisition_tombstones WHERE id = ANY(%s)", (created_ids,))
+    cursor.execute(
+        """
+        UPDATE requisitions
+        SET status = 'pending_level2', approved_by_level2_user_id = NULL,
+            approved_by_level2_user_cpf_id = NULL, approved_by_level2_user_name = NULL, decision_at = NULL
+        WHERE id = ANY(%s)
+        """,
+        (decided_ids,)
+    )
+    conn.commit()
+
+
+def environment_info(conn):
+    cursor = conn.cursor()
+    cursor.execute("SHOW server_version")
+    postgres_version = cursor.fetchone()[0]
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'gitCommit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'postgres': postgres_version,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    """Prints per-route changes and returns the regressions (p95 up by more than threshold %)."""
+    regressions = []
+    for size, routes in current['results'].items():
+        base_routes = baseline.get('results', {}).get(size)
+        if not base_routes:
+            continue
+        click.echo(f"\n{size} requisitions")
+        click.echo(f"  {'route':45} {'p95 before':>11} {'p95 after':>11} {'change':>8} {'rps change':>11}")
+        for name, stats in routes.items():
+            before = base_routes.get(name)
+            if not before or not before.get('p95Ms') or stats.get('p95Ms') is None:
+                continue
+            change = (stats['p95Ms'] - before['p95Ms']) / before['p95Ms'] * 100
+            rps_change = ((stats['throughputRps'] - before['throughputRps']) / before['throughputRps'] * 100
+                          if before.get('throughputRps') else 0.0)
+            flag = '  REGRESSION' if change > threshold else ''
+            click.echo(f"  {name:45} {before['p95Ms']:>9.2f}ms {stats['p95Ms']:>9.2f}ms "
+                       f"{change:>+7.1f}% {rps_change:>+10.1f}%{flag}")
+            if change > threshold:
+                regressions.append((size, name, change))
+    return regressions
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--database-url', envvar='BENCHMARK_DATABASE_URL', required=True,
+              help="Disposable database to seed and benchmark (BENCHMARK_DATABASE_URL).")
+@click.option('--sizes', default='10000,100000,1000000', show_default=True,
+              help="Comma-separated requisition counts to seed and benchmark.")
+@click.option('--iterations', default=200, show_default=True, help="Timed requests per route.")
+@click.option('--warmup', default=10, show_default=True, help="Untimed requests per route before measuring.")
+@click.option('--concurrency', default=1, show_default=True, help="Requests in flight at once.")
+@click.option('--reseed', is_flag=True, help="Reseed even when the table already has the right size.")
+@click.option('--output', type=click.Path(dir_okay=False), help="Write the JSON results here (default: stdout).")
+@click.option('--compare', 'baseline_path', type=click.Path(exists=True, dir_okay=False),
+              help="Earlier results to compare against; exits 1 on regressions.")
+@click.option('--threshold', default=20.0, show_default=True, help="p95 increase (%) that counts as a regression.")
+def run(database_url, sizes, iterations, warmup, concurrency, reseed, output, baseline_path, threshold):
+    """Seeds each size, benchmarks every route and reports the results."""
+    os.environ['DATABASE_URL'] = database_url
+    pdf_cache_dir = tempfile.mkdtemp(prefix='requisition_pdf_bench_')
+    os.environ['PDF_CACHE_DIR'] = pdf_cache_dir
+    # Renders are measured to completion, never answered with 202.
+    os.environ.setdefault('PDF_RENDER_WAIT', '120')
+
+    # Imported late: the app reads its configuration on import.
+    from app import app
+    from db import db_connection
+    from migrations import migrate
+    from passwords import hash_password
+
+    results = {}
+    try:
+        with db_connection() as conn:
+            migrate(conn)
+            meta = environment_info(conn)
+        password_hash = hash_password(BENCHMARK_PASSWORD)
+        token = app.test_client().post(
+            '/api/login', json={'cpfId': 'admin123', 'password': 'password123'}
+        ).get_json().get('token')
+        auth_headers = {'Authorization': f"Bearer {token}"} if token else {}
+
+        for size in [int(value) for value in sizes.split(',') if value.strip()]:
+            with db_connection() as conn:
+                seed(conn, size, password_hash, reseed)
+            scenarios, created_ids, decided_ids = build_scenarios(size, auth_headers, iterations, warmup)
+            results[str(size)] = {}
+            try:
+                for name, request_fn in scenarios:
+                    stats = run_scenario(app, request_fn, iterations, concurrency, warmup)
+                    results[str(size)][name] = stats
+                    click.echo(f"[{size}] {name:45} p50 {stats['p50Ms']:>8.2f}ms  p95 {stats['p95Ms']:>8.2f}ms  "
+                               f"p99 {stats['p99Ms']:>8.2f}ms  {stats['throughputRps']:>8.1f} req/s"
+                               f"{'  errors: ' + str(stats['errors']) if stats['errors'] else ''}", err=True)
+            finally:
+                with db_connection() as conn:
+                    restore(conn, created_ids, decided_ids)
+    finally:
+        shutil.rmtree(pdf_cache_dir, ignore_errors=True)
+
+    report = {
+        'meta': dict(meta, iterations=iterations, warmup=warmup, concurrency=concurrency),
+        'results': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Results written to {output}", err=True)
+    else:
+        click.echo(json.dumps(report, indent=2))
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare_results(json.load(f), report, threshold)
+        if regressions:
+            click.echo(f"\n{len(regressions)} route(s) regressed by more than {threshold:g}% at p95.", err=True)
+            sys.exit(1)
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=20.0, show_default=True, help="p95 increase (%) that counts as a regression.")
+def compare(baseline, current, threshold):
+    """Compares two result files; exits 1 on regressions."""
+    with open(baseline) as f:
+        baseline_report = json.load(f)
+    with open(current) as f:
+        current_report = json.load(f)
+    regressions = compare_results(baseline_report, current_report, threshold)
+    if regressions:
+        click.echo(f"\n{len(regressions)} route(s) regressed by more than {threshold:g}% at p95.", err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
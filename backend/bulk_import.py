@@ -0,0 +1,167 @@
+import os
+import io
+import csv
+import json
+import uuid
+
+import psycopg2
+import psycopg2.extras
+
+from events import requisition_event, notify_requisition_events
+from requisitions import (
+    REQUEST_FIELDS, INSERT_COLUMNS, build_requisition_data, missing_mandatory_field,
+)
+
+# Rows sent per INSERT ... VALUES statement (and committed together).
+BULK_INSERT_CHUNK_SIZE = int(os.environ.get('BULK_INSERT_CHUNK_SIZE', 500))
+
+INSERT_SQL = f"INSERT INTO requisitions ({', '.join(INSERT_COLUMNS)}) VALUES %s"
+
+# Accept both the API's camelCase keys and the column names as file headers.
+_HEADER_ALIASES = {column: key for column, key in REQUEST_FIELDS.items()}
+_HEADER_ALIASES.update({
+    'requested_by_user_id': 'requestedByUserId',
+    'requested_by_user_cpf_id': 'requestedByUserCpfId',
+    'created_at': 'createdAt',
+})
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import file can't be parsed at all."""
+
+
+def _normalize_record(record):
+    normalized = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = key.strip()
+        if isinstance(value, str):
+            value = value.strip() or None
+        normalized[_HEADER_ALIASES.get(key, key)] = value
+    return normalized
+
+
+def normalize_records(records):
+    """Applies the file header aliases to JSON objects; other items are left for prepare_records to reject."""
+    return [_normalize_record(record) if isinstance(record, dict) else record for record in records]
+
+
+def read_json_records(stream):
+    try:
+        records = json.load(stream)
+    except ValueError as e:
+        raise ImportFormatError(f"Invalid JSON: {e}")
+    if not isinstance(records, list):
+        raise ImportFormatError("JSON import must be an array of requisition objects")
+    return normalize_records(records)
+
+
+def read_csv_records(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return [_normalize_record(row) for row in csv.DictReader(text)]
+
+
+def read_xlsx_records(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError("openpyxl is required to import .xlsx files")
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return []
+        header = [str(cell) if cell is not None else None for cell in header]
+        return [
+            _normalize_record(dict(zip(header, row)))
+            for row in rows
+            if any(cell is not None for cell in row)
+        ]
+    finally:
+        workbook.close()
+
+
+def read_records(stream, filename):
+    """Parses a binary JSON array, CSV or XLSX stream into a list of payload dicts."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.json':
+        return read_json_records(stream)
+    if extension == '.csv':
+        return read_csv_records(stream)
+    if extension == '.xlsx':
+        return read_xlsx_records(stream)
+    raise ImportFormatError(f"Unsupported import file type '{extension or filename}', use .json, .csv or .xlsx")
+
+
+def prepare_records(records, requested_by_user_id=None, requested_by_user_cpf_id=None):
+    """Validates payloads exactly like create_requisition.
+
+    Returns (rows, errors) where rows are (index, requisition_data) pairs ready
+    to insert and errors are per-row reports. The requester identity given
+    here (e.g. from the caller's token) overrides the one in each record.
+    """
+    rows = []
+    errors = []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({"index": index, "message": "Each requisition must be an object"})
+            continue
+        requisition_data = build_requisition_data(
+            record,
+            requested_by_user_id=requested_by_user_id or record.get('requestedByUserId'),
+            requested_by_user_cpf_id=requested_by_user_cpf_id or record.get('requestedByUserCpfId'),
+            created_at=record.get('createdAt'),
+        )
+        missing_message = missing_mandatory_field(requisition_data)
+        if missing_message:
+            errors.append({"index": index, "message": missing_message})
+            continue
+        requisition_data['id'] = str(uuid.uuid4())
+        rows.append((index, requisition_data))
+    return rows, errors
+
+
+def insert_requisitions(conn, rows, chunk_size=BULK_INSERT_CHUNK_SIZE):
+    """Inserts prepared rows with execute_values, committing chunk by chunk.
+
+    A chunk the database rejects is retried row by row inside savepoints, so
+    one bad value (e.g. an unparseable date) only fails its own row.
+    Returns (created, errors) where created is a list of (index, id).
+    """
+    cursor = conn.cursor()
+    created = []
+    errors = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        values = [tuple(data[column] for column in INSERT_COLUMNS) for _, data in chunk]
+        try:
+            psycopg2.extras.execute_values(cursor, INSERT_SQL, values, page_size=len(values))
+            notify_created(cursor, [data for _, data in chunk])
+            conn.commit()
+            created.extend((index, data['id']) for index, data in chunk)
+            continue
+        except psycopg2.Error:
+            conn.rollback()
+
+        inserted = []
+        for (index, data), row_values in zip(chunk, values):
+            cursor.execute("SAVEPOINT import_row")
+            try:
+                psycopg2.extras.execute_values(cursor, INSERT_SQL, [row_values])
+                cursor.execute("RELEASE SAVEPOINT import_row")
+                created.append((index, data['id']))
+                inserted.append(data)
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT import_row")
+                errors.append({"index": index, "message": f"Database error: {e.diag.message_primary or str(e).strip()}"})
+        notify_created(cursor, inserted)
+        conn.commit()
+    return created, errors
+
+
+def notify_created(cursor, rows):
+    notify_requisition_events(cursor, [
+        requisition_event('created', data['id'], data['status'], data['requested_by_user_id']) for data in rows
+    ])
@@ -0,0 +1,439 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
+
+from metrics import DB_CONNECT_SECONDS, DB_POOL_EXHAUSTED, DB_POOL_WAIT_SECONDS
+from sql_profile import record_query
+
+# --- DATABASE CONFIGURATION FOR POSTGRESQL ---
+DATABASE_URL = os.environ.get('DATABASE_URL')
+# Optional comma-separated streaming replicas for read-only routes.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Seconds a replica that failed to connect is skipped before being retried.
+REPLICA_RETRY_AFTER = float(os.environ.get('REPLICA_RETRY_AFTER', 30))
+
+# Pool sizing is per gunicorn worker, so the total number of server connections
+# is roughly workers * DB_POOL_MAX_SIZE.
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+# Seconds a request waits for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# Seconds after which a connection is closed and replaced instead of reused.
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+# Connections idle for longer than this are pinged with SELECT 1 on checkout.
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', 10))
+
+
+class PoolExhausted(pg_pool.PoolError):
+    """Raised when no connection became free within DB_POOL_TIMEOUT."""
+
+
+class _TimedCursorMixin:
+    """Reports every statement's duration and row count to sql_profile.record_query."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(self._query_text(query), vars, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(self._query_text(query), None, time.perf_counter() - started, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(self._query_text(sql), None, time.perf_counter() - started, self.rowcount)
+
+    def _query_text(self, query):
+        # psycopg2.sql objects only become text against a connection.
+        if isinstance(query, (str, bytes)):
+            return query
+        return query.as_string(self.connection)
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(cursor_factory):
+    cls = _timed_cursor_classes.get(cursor_factory)
+    if cls is None:
+        cls = type(f"Timed{cursor_factory.__name__}", (_TimedCursorMixin, cursor_factory), {})
+        _timed_cursor_classes[cursor_factory] = cls
+    return cls
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory, are timed."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def connect(url):
+    with DB_CONNECT_SECONDS.time():
+        return psycopg2.connect(url, connection_factory=TimedConnection)
+
+
+def get_db_connection():
+    """Establishes a PostgreSQL database connection."""
+    if not DATABASE_URL:
+        raise Exception("DATABASE_URL environment variable is not set.")
+    return connect(DATABASE_URL)
+
+
+class ConnectionPool:
+    """Thread-safe connection pool with checkout health checks and recycling."""
+
+    def __init__(self, connect, min_size, max_size, timeout, max_lifetime, healthcheck_after, name='primary'):
+        if min_size > max_size:
+            raise ValueError("DB_POOL_MIN_SIZE cannot be larger than DB_POOL_MAX_SIZE")
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_after = healthcheck_after
+        self.name = name  # label for the pool metrics
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, created_at, last_used_at), most recently used last
+        self._created = {}  # id(conn) -> created_at for every open connection
+        self._size = 0  # open connections plus slots reserved by in-flight connects
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+        self._exhausted = 0
+        self._opened = 0
+        self._recycled = 0
+        self._failed_healthchecks = 0
+
+        for _ in range(min_size):
+            conn = self._open()
+            self._idle.append((conn, self._created[id(conn)], time.monotonic()))
+
+    def _open(self):
+        conn = self.connect()
+        with self._cond:
+            self._size += 1
+            self._created[id(conn)] = time.monotonic()
+            self._opened += 1
+        return conn
+
+    def _close(self, conn):
+        with self._cond:
+            self._size -= 1
+            self._created.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, created_at, last_used_at):
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - last_used_at > self.healthcheck_after:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._failed_healthchecks += 1
+                return False
+        return True
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to `timeout` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            candidate = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._exhausted += 1
+                        DB_POOL_EXHAUSTED.labels(self.name).inc()
+                        raise PoolExhausted(
+                            f"No database connection available after {self.timeout:g}s "
+                            f"(pool max size {self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    # Reserve the slot, then connect outside the lock.
+                    self._size += 1
+
+            if candidate is not None:
+                conn, created_at, last_used_at = candidate
+                if not self._is_healthy(conn, created_at, last_used_at):
+                    self._close(conn)
+                    continue
+            else:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created[id(conn)] = time.monotonic()
+                    self._opened += 1
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+                self._wait_seconds_total += waited
+                self._wait_seconds_max = max(self._wait_seconds_max, waited)
+            DB_POOL_WAIT_SECONDS.labels(self.name).observe(waited)
+            return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, resetting or discarding it as needed."""
+        keep = not conn.closed
+        if keep and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            created_at = self._created.get(id(conn))
+            if keep and created_at is not None and time.monotonic() - created_at > self.max_lifetime:
+                self._recycled += 1
+                keep = False
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            self._close(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pid": self.pid,
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "inUse": self._in_use,
+                "checkouts": self._checkouts,
+                "waitSecondsTotal": round(self._wait_seconds_total, 6),
+                "waitSecondsMax": round(self._wait_seconds_max, 6),
+                "waitSecondsAvg": round(self._wait_seconds_total / self._checkouts, 6) if self._checkouts else 0.0,
+                "exhausted": self._exhausted,
+                "opened": self._opened,
+                "recycled": self._recycled,
+                "failedHealthchecks": self._failed_healthchecks,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _new_pool(connect_fn, min_size=DB_POOL_MIN_SIZE, name='primary'):
+    return ConnectionPool(
+        connect_fn,
+        min_size=min_size,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        healthcheck_after=DB_POOL_HEALTHCHECK_AFTER,
+        name=name,
+    )
+
+
+def get_pool():
+    """Returns this process's pool, creating a fresh one after a fork."""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # Connections inherited from a parent process are never reused or
+                # closed here: their sockets still belong to the parent.
+                _pool = _new_pool(get_db_connection)
+    return _pool
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.host = psycopg2.extensions.parse_dsn(url).get('host') or 'localhost'
+        # Connections are opened on demand so a dead replica never delays startup.
+        self.pool = _new_pool(lambda: connect(url), min_size=0, name=f"replica:{self.host}")
+        self.down_until = 0.0
+
+    def mark_down(self, error):
+        self.down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        print(f"Read replica {self.host} unavailable, using others for {REPLICA_RETRY_AFTER:g}s: {error}")
+
+
+class ReplicaRouter:
+    """Round-robin over the configured replicas, skipping ones that recently failed."""
+
+    def __init__(self, urls):
+        self.pid = os.getpid()
+        self.replicas = [Replica(url) for url in urls]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        """Healthy replicas, starting with the next one in turn."""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        now = time.monotonic()
+        ordered = self.replicas[start:] + self.replicas[:start]
+        return [replica for replica in ordered if replica.down_until <= now]
+
+    def closeall(self):
+        for replica in self.replicas:
+            replica.pool.closeall()
+
+
+_router = None
+
+
+def get_replica_router():
+    """Returns this process's replica router, or None without DATABASE_REPLICA_URLS."""
+    global _router
+    if not DATABASE_REPLICA_URLS:
+        return None
+    if _router is None or _router.pid != os.getpid():
+        with _pool_lock:
+            if _router is None or _router.pid != os.getpid():
+                _router = ReplicaRouter(DATABASE_REPLICA_URLS)
+    return _router
+
+
+def reset_pool():
+    """Drops the current pools so the next checkout builds new ones."""
+    global _pool, _router
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        if _router is not None and _router.pid == os.getpid():
+            _router.closeall()
+        _pool = None
+        _router = None
+
+
+@contextmanager
+def db_connection():
+    """Checks a connection out of the pool and always gives it back.
+
+    Any transaction left open by the caller is rolled back on return.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def server_timezone(conn):
+    """The session's TimeZone setting, which LOCALTIMESTAMP columns are written in."""
+    return conn.info.parameter_status('TimeZone')
+
+
+def write_position(conn):
+    """WAL position just after `conn`'s last commit, for read_connection(min_lsn=...)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_current_wal_lsn()::text")
+    lsn = cursor.fetchone()[0]
+    conn.rollback()
+    return lsn
+
+
+def _replayed(conn, min_lsn):
+    cursor = conn.cursor()
+    # NULL on a server that isn't in recovery, which has every write.
+    cursor.execute("SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, TRUE)", (min_lsn,))
+    return cursor.fetchone()[0]
+
+
+@contextmanager
+def read_connection(use_primary=False, min_lsn=None):
+    """Checks out a connection for read-only work.
+
+    Uses the next healthy replica when DATABASE_REPLICA_URLS is set, and the
+    primary when there are none, all are down, or `use_primary` is true.
+    With `min_lsn` (a write_position() value) only replicas that have
+    replayed at least that far qualify, so a caller sees its own writes.
+    """
+    router = None if use_primary else get_replica_router()
+    for replica in router.candidates() if router else []:
+        try:
+            conn = replica.pool.getconn()
+        except PoolExhausted:
+            # Busy rather than broken: try the next one without marking it down.
+            continue
+        except psycopg2.OperationalError as e:
+            replica.mark_down(e)
+            continue
+        try:
+            caught_up = not min_lsn or _replayed(conn, min_lsn)
+        except psycopg2.OperationalError as e:
+            replica.pool.putconn(conn)
+            replica.mark_down(e)
+            continue
+        if not caught_up:
+            replica.pool.putconn(conn)
+            continue
+        try:
+            yield conn
+        finally:
+            replica.pool.putconn(conn)
+        return
+    with db_connection() as conn:
+        yield conn
+
+
+def pool_stats():
+    """Returns counters for this worker's pool (wait time, exhaustion, size)."""
+    stats = get_pool().stats()
+    router = get_replica_router()
+    if router:
+        now = time.monotonic()
+        stats["replicas"] = [
+            dict(replica.pool.stats(), host=replica.host, down=replica.down_until > now)
+            for replica in router.replicas
+        ]
+    return stats
@@ -0,0 +1,166 @@
+import os
+import json
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from db import get_db_connection
+
+# PostgreSQL channel carrying requisition change notifications.
+EVENTS_CHANNEL = 'requisition_events'
+# Seconds between keep-alive comments on idle SSE streams.
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# Events buffered per connected client; a client that falls further behind
+# is disconnected and reconnects (EventSource does so automatically).
+SSE_CLIENT_QUEUE_SIZE = int(os.environ.get('SSE_CLIENT_QUEUE_SIZE', 100))
+# Open streams allowed per worker process (0 for no limit). Under threaded
+# workers each stream holds a thread for as long as it is open, so the cap
+# keeps dashboards from starving ordinary requests; gunicorn.conf.py adds it
+# to the thread count.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 16))
+
+
+class TooManyStreams(Exception):
+    """Raised by EventBroker.subscribe when SSE_MAX_STREAMS are already open."""
+
+
+def requisition_event(event_type, requisition_id, status, requested_by_user_id):
+    return {
+        'type': event_type,
+        'id': requisition_id,
+        'status': status,
+        'requestedByUserId': requested_by_user_id,
+    }
+
+
+def notify_requisition_events(cursor, events):
+    """Queues NOTIFYs for `events` in the caller's transaction.
+
+    PostgreSQL delivers them only when that transaction commits, so listeners
+    never hear about writes that were rolled back.
+    """
+    if not events:
+        return
+    cursor.execute(
+        "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+        (EVENTS_CHANNEL, [json.dumps(event, separators=(',', ':')) for event in events])
+    )
+
+
+class Subscription:
+    def __init__(self, accepts):
+        self.accepts = accepts
+        self.events = queue.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBroker:
+    """One LISTEN connection per worker process, fanned out to SSE subscribers."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, accepts):
+        subscription = Subscription(accepts)
+        with self._lock:
+            if SSE_MAX_STREAMS and len(self._subscriptions) >= SSE_MAX_STREAMS:
+                raise TooManyStreams(f"This worker already serves {SSE_MAX_STREAMS} event streams")
+            self._subscriptions.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen_forever, name='requisition-events', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _listen_forever(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {EVENTS_CHANNEL}")
+                backoff = 1
+                while True:
+                    # Wake up periodically so a dead connection is noticed.
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        conn.cursor().execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"Requisition event listener error, reconnecting in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.accepts(event):
+                continue
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Returns this process's broker, creating a fresh one after a fork."""
+    global _broker
+    with _broker_lock:
+        if _broker is None or _broker.pid != os.getpid():
+            _broker = EventBroker()
+    return _broker
+
+
+def event_filter(role, user_id):
+    """Which events a dashboard should see.
+
+    Requesters (level1) only hear about their own requisitions, level-2
+    approvers about everything entering or leaving their queue, level3 about
+    approvals, and admins about everything.
+    """
+    if role == 'level1' or (not role and user_id):
+        return lambda event: event.get('requestedByUserId') == user_id
+    if role == 'level3':
+        return lambda event: event.get('type') == 'decided' and event.get('status') == 'approved_level2'
+    return lambda event: True
+
+
+def sse_stream(subscription, broker):
+    """Yields Server-Sent Events for `subscription`, with keep-alive comments."""
+    try:
+        yield "retry: 5000\n\n"
+        while not subscription.overflowed:
+            try:
+                event = subscription.events.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                # Comment line: keeps proxies from closing the idle stream.
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
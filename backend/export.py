@@ -0,0 +1,151 @@
+import os
+import queue
+import tempfile
+import threading
+
+import psycopg2
+from psycopg2 import sql
+
+from db import db_connection
+from requisitions import REQUISITION_COLUMNS, where_clause
+
+# Bytes of CSV gathered before a chunk is handed to the HTTP response.
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 64 * 1024))
+# Chunks buffered between the COPY thread and the response; bounds memory.
+EXPORT_QUEUE_CHUNKS = int(os.environ.get('EXPORT_QUEUE_CHUNKS', 8))
+# Rows per round trip from the server-side cursor when writing XLSX.
+EXPORT_XLSX_BATCH_SIZE = int(os.environ.get('EXPORT_XLSX_BATCH_SIZE', 2000))
+
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """Raised inside the COPY thread when the client went away."""
+
+
+def export_query(cursor, conditions, params):
+    """Returns the export SELECT with the filter params already bound.
+
+    COPY can't take bind parameters, so the values are quoted client-side
+    with mogrify, which uses the same escaping as a normal execute.
+    """
+    columns = sql.SQL(', ').join(sql.Identifier(column) for column in REQUISITION_COLUMNS)
+    query = sql.SQL("SELECT {} FROM requisitions").format(columns).as_string(cursor)
+    query += where_clause(conditions) + " ORDER BY created_at DESC, id DESC"
+    return cursor.mogrify(query, params).decode('utf-8')
+
+
+def copy_csv(cursor, conditions, params, file):
+    """Writes the filtered requisitions to `file` as CSV using COPY ... TO STDOUT."""
+    query = export_query(cursor, conditions, params)
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", file)
+
+
+class _ChunkWriter:
+    """File-like target for copy_expert that forwards fixed-size chunks to a queue."""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= EXPORT_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item):
+        # Blocks while the client is slower than the database (backpressure),
+        # but gives up once the response generator has been closed.
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_csv(conditions, params):
+    """Yields CSV chunks produced by COPY, holding at most a few chunks in memory.
+
+    copy_expert only writes into a file object, so COPY runs in a helper
+    thread feeding a bounded queue that this generator drains.
+    """
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def run_copy():
+        writer = _ChunkWriter(chunks, cancelled)
+        try:
+            with db_connection() as conn:
+                copy_csv(conn.cursor(), conditions, params, writer)
+            writer.flush()
+            writer.put(_DONE)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            try:
+                writer.put(e)
+            except ExportCancelled:
+                pass
+
+    thread = threading.Thread(target=run_copy, name='requisition-export', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def write_xlsx(conn, conditions, params, target):
+    """Writes the filtered requisitions to `target` as XLSX in constant memory.
+
+    Rows come from a server-side cursor and go into an openpyxl write-only
+    workbook, which spools each row to disk instead of keeping it.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("openpyxl is required to export .xlsx files")
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title='Requisitions')
+    worksheet.append(REQUISITION_COLUMNS)
+
+    cursor = conn.cursor(name='requisitions_export')
+    cursor.itersize = EXPORT_XLSX_BATCH_SIZE
+    cursor.execute(export_query(conn.cursor(), conditions, params))
+    while True:
+        rows = cursor.fetchmany(EXPORT_XLSX_BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            worksheet.append(row)
+    cursor.close()
+    workbook.save(target)
+
+
+def xlsx_tempfile(conditions, params):
+    """Builds the XLSX export in an anonymous temporary file, rewound for reading."""
+    target = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        with db_connection() as conn:
+            write_xlsx(conn, conditions, params, target)
+    except (psycopg2.Error, RuntimeError):
+        target.close()
+        raise
+    target.seek(0)
+    return target
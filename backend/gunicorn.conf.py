@@ -0,0 +1,116 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py app:app
+
+Everything can be overridden from the environment:
+
+    GUNICORN_WORKER_CLASS  sync | gthread | gevent (default gthread)
+    WEB_CONCURRENCY        worker processes (default depends on class and CPUs)
+    GUNICORN_THREADS       threads per gthread worker (default 4 + SSE_MAX_STREAMS)
+    GUNICORN_WORKER_CONNECTIONS  concurrent greenlets per gevent worker (default 1000)
+    GUNICORN_TIMEOUT       seconds before a silent worker is killed (default 60)
+    GUNICORN_MAX_REQUESTS  requests before a worker is recycled (default 1000, 0 disables)
+    GUNICORN_PRELOAD       load the app once in the master before forking (default on)
+
+Sync workers handle one request at a time, so a PDF render wait or an open
+/api/requisitions/events stream occupies a whole process; gthread (the
+default) or gevent keep serving other requests meanwhile. Under gthread each
+open event stream holds a thread, so workers get SSE_MAX_STREAMS threads on
+top of the 4 for ordinary requests, and further streams are refused with a
+503. Under gevent streams are cheap greenlets and are not capped by default.
+Size DB_POOL_MAX_SIZE to at least the expected concurrent DB users per
+worker (streams use none): the total number of server connections is
+workers * DB_POOL_MAX_SIZE.
+
+gevent workers need the extra packages in requirements-gevent.txt. They also
+need CPU-bound work off the event loop: monkey-patched threads are greenlets,
+so password hashing is forced onto PASSWORD_HASH_EXECUTOR=process (PDF
+rendering already uses processes).
+"""
+import os
+import multiprocessing
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class not in ('sync', 'gthread', 'gevent'):
+    raise RuntimeError(f"GUNICORN_WORKER_CLASS must be sync, gthread or gevent, not {worker_class!r}")
+
+if worker_class == 'gevent':
+    # Patch before the app (and psycopg2) is imported by preload_app, so every
+    # socket, lock and database wait yields to other greenlets.
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        raise RuntimeError("The gevent worker class needs requirements-gevent.txt installed (gevent, psycogreen)")
+    monkey.patch_all()
+    patch_psycopg()
+    # A hash running in a patched "thread" would block every greenlet.
+    if os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread') != 'process':
+        print("gevent workers hash passwords in processes: setting PASSWORD_HASH_EXECUTOR=process")
+        os.environ['PASSWORD_HASH_EXECUTOR'] = 'process'
+    os.environ.setdefault('SSE_MAX_STREAMS', '0')
+
+_cpus = multiprocessing.cpu_count()
+_default_workers = {
+    'sync': _cpus * 2 + 1,
+    'gthread': _cpus + 1,
+    'gevent': _cpus,
+}[worker_class]
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', _default_workers))
+# Same default as events.SSE_MAX_STREAMS; not imported to keep the app (and
+# psycopg2) out of the config until gevent has patched.
+_sse_streams = int(os.environ.get('SSE_MAX_STREAMS', 16))
+threads = int(os.environ.get('GUNICORN_THREADS', 4 + _sse_streams)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# PDF downloads wait up to PDF_RENDER_WAIT for a render and exports stream
+# for as long as the client reads, so allow more than gunicorn's 30s.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically to cap slow leaks; the jitter keeps them from
+# all restarting at the same moment.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+# Importing the app no longer touches the database (schema changes run in the
+# release step), and every pool and executor is created lazily per process,
+# so loading it once in the master is safe and makes forks cheap.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+# The default format logs the full request line; log the path without the
+# query string so ?access_token= (event streams) never reaches the logs.
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+
+# prometheus_client writes there as soon as preload imports the app.
+_multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if _multiproc_dir:
+    os.makedirs(_multiproc_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Metric files left by a previous run would be summed into /metrics;
+    # keep only the ones this master just created while preloading.
+    if _multiproc_dir:
+        suffix = f"_{os.getpid()}.db"
+        for name in os.listdir(_multiproc_dir):
+            if not name.endswith(suffix):
+                os.remove(os.path.join(_multiproc_dir, name))
+    if worker_class == 'sync':
+        print("Running sync workers: each open event stream or PDF wait blocks a whole worker.")
+
+
+def post_fork(server, worker):
+    # A pool built in the master (e.g. by preload) must not be shared: drop
+    # it so this worker opens its own connections on first use.
+    from db import reset_pool
+    reset_pool()
+
+
+def child_exit(server, worker):
+    from metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -0,0 +1,391 @@
+"""Load generator for a running instance of the API.
+
+Two modes, both reporting per-operation latency distributions:
+
+    # Replay a recorded log, one JSON object per line with method, path and
+    # optionally body, headers and offset (seconds since the first request).
+    python loadgen.py replay requests.log.jsonl --base-url http://localhost:8000 --concurrency 16
+
+    # Synthetic mix: requesters creating and listing their requisitions,
+    # approvers bulk-deciding pending ones, admins exporting CSV.
+    python loadgen.py mix --base-url http://localhost:8000 --rate 50 --duration 60 --concurrency 32
+
+In the mix only approvals and exports use the --cpf-id account. Requesters
+are anonymous callers naming themselves in the body (load-user-N), or, with
+--requester-cpf-prefix, real accounts such as the bench1..benchN users
+seeded by benchmark.py, which is required when REQUIRE_AUTH_TOKEN is on.
+
+With --rate the load is open-loop: requests arrive as a Poisson process no
+matter how fast the server answers, and latency is measured from the
+intended arrival time, so queueing inside the server (busy gunicorn
+workers, an exhausted connection pool) shows up in the percentiles instead
+of slowing the generator down. Without --rate every worker sends requests
+back to back (closed loop), which measures peak throughput.
+"""
+import sys
+import json
+import time
+import queue
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+from collections import defaultdict
+
+import click
+
+from benchmark import BENCHMARK_PASSWORD, summarize
+
+# Relative weights of the synthetic operations, roughly many requesters,
+# a few approvers and the occasional admin export.
+DEFAULT_MIX = {
+    'create_requisition': 60,
+    'list_own_requisitions': 25,
+    'bulk_decide': 10,
+    'export_csv': 5,
+}
+BASINS = ['Krishna Godavari', 'Cauvery', 'Mumbai Offshore', 'Assam Shelf', 'Cambay', 'Rajasthan']
+USER_GROUPS = ['Exploration', 'Geophysics', 'Reservoir', 'Drilling', 'Data Management']
+
+
+class HttpClient:
+    """One keep-alive connection, re-opened whenever the server closes it."""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, body bytes); the body is always read to the end."""
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = body if isinstance(body, (bytes, str)) else json.dumps(body)
+            headers.setdefault('Content-Type', 'application/json')
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                self.conn.request(method, self.prefix + path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self.close()
+                return response.status, data
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # A keep-alive connection the server already dropped: retry once.
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Recorder:
+    """Collects (operation, latency, ok, status) samples from every worker thread."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queue_waits = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def record(self, operation, latency, queue_wait, status, ok):
+        with self.lock:
+            self.latencies[operation].append(latency)
+            self.queue_waits[operation].append(queue_wait)
+            self.statuses[operation][str(status)] += 1
+            if not ok:
+                self.errors[operation] += 1
+
+    def report(self, wall_seconds):
+        operations = {}
+        for operation in sorted(self.latencies):
+            stats = summarize(self.latencies[operation], self.errors[operation], wall_seconds)
+            waits = self.queue_waits[operation]
+            stats['queueWaitMeanMs'] = round(sum(waits) / len(waits) * 1000, 3)
+            stats['statuses'] = dict(self.statuses[operation])
+            operations[operation] = stats
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        total = summarize(all_latencies, sum(self.errors.values()), wall_seconds)
+        return {'total': total, 'operations': operations}
+
+
+def run_load(jobs, execute, concurrency, rate, duration, seed):
+    """Runs `jobs` (an iterator of (operation, payload, offset)) against `execute`.
+
+    `execute(client, operation, payload)` performs one operation and returns
+    (status, ok). With `rate`, arrivals are Poisson at `rate` per second; with
+    recorded offsets (replay, no rate) they follow the recording; otherwise
+    workers pull jobs as fast as they can. Returns the Recorder and the wall time.
+    """
+    recorder = Recorder()
+    pending = queue.Queue(maxsize=concurrency * 4)
+    stop = threading.Event()
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def schedule():
+        next_arrival = started
+        try:
+            for operation, payload, offset in jobs:
+                if stop.is_set() or (deadline and time.perf_counter() >= deadline):
+                    break
+                if rate:
+                    next_arrival += rng.expovariate(rate)
+                elif offset is not None:
+                    next_arrival = started + offset
+                else:
+                    next_arrival = None
+                if next_arrival is not None:
+                    delay = next_arrival - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                pending.put((operation, payload, next_arrival))
+        finally:
+            for _ in range(concurrency):
+                pending.put(None)
+
+    def work(client):
+        while True:
+            job = pending.get()
+            if job is None:
+                return
+            operation, payload, intended = job
+            sent = time.perf_counter()
+            try:
+                status, ok = execute(client, operation, payload)
+            except Exception as e:
+                status, ok = type(e).__name__, False
+            finished = time.perf_counter()
+            begin = intended if intended is not None else sent
+            recorder.record(operation, finished - begin, max(sent - begin, 0.0), status, ok)
+
+    scheduler = threading.Thread(target=schedule, name='loadgen-scheduler', daemon=True)
+    scheduler.start()
+    workers = []
+    for number in range(concurrency):
+        worker = threading.Thread(target=work, args=(execute.client_factory(),),
+                                  name=f"loadgen-worker-{number}", daemon=True)
+        worker.start()
+        workers.append(worker)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        stop.set()
+        click.echo("Interrupted, reporting what was collected so far.", err=True)
+    return recorder, time.perf_counter() - started
+
+
+def load_replay_jobs(path):
+    """Reads a JSONL request log, skipping lines that aren't requests."""
+    jobs = []
+    skipped = 0
+    first_offset = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or not entry.get('method') or not str(entry.get('path', '')).startswith('/'):
+                skipped += 1
+                continue
+            offset = entry.get('offset')
+            if offset is not None:
+                if first_offset is None:
+                    first_offset = offset
+                offset -= first_offset
+            jobs.append((entry.get('name') or f"{entry['method'].upper()} {entry['path'].split('?', 1)[0]}",
+                         entry, offset))
+    return jobs, skipped
+
+
+def login(base_url, cpf_id, password, timeout, with_uid=False):
+    status, body = HttpClient(base_url, timeout).request('POST', '/api/login', {'cpfId': cpf_id, 'password': password})
+    if status != 200:
+        raise click.ClickException(f"Login as {cpf_id} failed with HTTP {status}: {body[:200]!r}")
+    data = json.loads(body)
+    return (data.get('token'), data.get('uid')) if with_uid else data.get('token')
+
+
+def print_report(report, output):
+    click.echo(f"\n{'operation':32} {'count':>7} {'errors':>6} {'req/s':>8} {'p50':>9} {'p95':>9} "
+               f"{'p99':>9} {'max':>9} {'queue':>8}", err=True)
+    rows = list(report['operations'].items()) + [('TOTAL', report['total'])]
+    for operation, stats in rows:
+        if not stats['requests']:
+            continue
+        click.echo(f"{operation[:32]:32} {stats['requests']:>7} {stats['errors']:>6} {stats['throughputRps']:>8.1f} "
+                   f"{stats['p50Ms']:>7.1f}ms {stats['p95Ms']:>7.1f}ms {stats['p99Ms']:>7.1f}ms "
+                   f"{stats['maxMs']:>7.1f}ms "
+                   f"{(str(round(stats['queueWaitMeanMs'], 1)) + 'ms') if 'queueWaitMeanMs' in stats else '':>8}",
+                   err=True)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"Results written to {output}", err=True)
+
+
+def common_options(command):
+    options = [
+        click.option('--base-url', default='http://localhost:8000', show_default=True),
+        click.option('--concurrency', default=8, show_default=True, help="Worker threads (requests in flight)."),
+        click.option('--rate', type=float, help="Open-loop arrival rate in requests/second (Poisson)."),
+        click.option('--duration', type=float, help="Stop scheduling new requests after this many seconds."),
+        click.option('--timeout', default=60.0, show_default=True, help="Per-request socket timeout."),
+        click.option('--seed', default=1, show_default=True, help="Random seed, for repeatable runs."),
+        click.option('--cpf-id', default='admin123', show_default=True, help="Account used to obtain a token."),
+        click.option('--password', default='password123', show_default=True),
+        click.option('--output', type=click.Path(dir_okay=False), help="Also write the report as JSON."),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('log_file', type=click.Path(exists=True, dir_okay=False))
+@common_options
+@click.option('--speed', default=1.0, show_default=True, help="Replay recorded offsets this many times faster.")
+@click.option('--repeat', default=1, show_default=True, help="Replay the log this many times.")
+def replay(log_file, base_url, concurrency, rate, duration, timeout, seed, cpf_id, password, output, speed, repeat):
+    """Replays a JSONL request log (method, path, body, headers, offset)."""
+    entries, skipped = load_replay_jobs(log_file)
+    if skipped:
+        click.echo(f"Skipped {skipped} line(s) without a method and path.", err=True)
+    if not entries:
+        raise click.ClickException("Nothing to replay.")
+    token = login(base_url, cpf_id, password, timeout) if cpf_id else None
+    log_span = max((offset or 0 for _, _, offset in entries), default=0)
+
+    def jobs():
+        for round_number in range(repeat):
+            for operation, entry, offset in entries:
+                if offset is not None:
+                    offset = (offset + round_number * log_span) / speed
+                yield operation, entry, offset
+
+    def execute(client, operation, entry):
+        headers = dict(entry.get('headers') or {})
+        if token and 'Authorization' not in headers:
+            headers['Authorization'] = f"Bearer {token}"
+        status, _ = client.request(entry['method'].upper(), entry['path'], entry.get('body'), headers)
+        expected = entry.get('expectStatus')
+        return status, (status == expected) if expected else status < 400
+
+    execute.client_factory = lambda: HttpClient(base_url, timeout)
+    recorder, wall_seconds = run_load(jobs(), execute, concurrency, rate, duration, seed)
+    print_report(recorder.report(wall_seconds), output)
+
+
+@cli.command()
+@common_options
+@click.option('--requests', 'total_requests', default=1000, show_default=True,
+              help="Requests to send when no --duration is given.")
+@click.option('--mix', 'mix_spec', default=','.join(f"{k}={v}" for k, v in DEFAULT_MIX.items()), show_default=True,
+              help="Relative weights of create_requisition, list_own_requisitions, bulk_decide and export_csv.")
+@click.option('--requesters', default=200, show_default=True, help="Distinct requester ids to spread creates over.")
+@click.option('--bulk-size', default=25, show_default=True, help="Requisitions decided per bulk_decide.")
+@click.option('--requester-cpf-prefix',
+              help="Log requesters in as <prefix>1..<prefix>N (e.g. 'bench') instead of sending them anonymously.")
+@click.option('--requester-password', default=BENCHMARK_PASSWORD, show_default=True)
+def mix(base_url, concurrency, rate, duration, timeout, seed, cpf_id, password, output,
+        total_requests, mix_spec, requesters, bulk_size, requester_cpf_prefix, requester_password):
+    """Generates a synthetic workload of requesters, approvers and admins."""
+    try:
+        weights = {name: float(weight) for name, weight in (part.split('=') for part in mix_spec.split(','))}
+    except ValueError:
+        raise click.BadParameter("use name=weight pairs, e.g. create_requisition=60,export_csv=5", param_hint='--mix')
+    unknown = set(weights) - set(DEFAULT_MIX)
+    if unknown:
+        raise click.BadParameter(f"unknown operation(s): {', '.join(sorted(unknown))}", param_hint='--mix')
+    token = login(base_url, cpf_id, password, timeout)
+    auth = {'Authorization': f"Bearer {token}"} if token else {}
+    # requester number -> (headers, user id). The server takes the identity
+    # from a token over the body, so requesters must not share the admin's.
+    requester_identities = {
+        requester: ({}, f"load-user-{requester}") for requester in range(1, requesters + 1)
+    }
+    if requester_cpf_prefix:
+        click.echo(f"Logging in {requesters} requester accounts...", err=True)
+        for requester in requester_identities:
+            requester_token, uid = login(base_url, f"{requester_cpf_prefix}{requester}", requester_password,
+                                         timeout, with_uid=True)
+            requester_identities[requester] = ({'Authorization': f"Bearer {requester_token}"}, uid)
+    rng = random.Random(seed)
+    names = list(weights)
+
+    def jobs():
+        count = 0
+        while duration or count < total_requests:
+            count += 1
+            operation = rng.choices(names, weights=[weights[name] for name in names])[0]
+            # Everything random is drawn here, in one thread, so a seed gives the same run.
+            yield operation, {
+                'requester': rng.randint(1, requesters),
+                'basin': rng.choice(BASINS),
+                'userGroup': rng.choice(USER_GROUPS),
+                'decision': rng.choice(['approved_level2', 'denied_level2']),
+            }, None
+
+    def execute(client, operation, job):
+        requester = job['requester']
+        requester_auth, requester_id = requester_identities[requester]
+        if operation == 'create_requisition':
+            status, _ = client.request('POST', '/api/requisitions', {
+                'title': 'Load test requisition', 'description': 'Generated by loadgen',
+                'basin': job['basin'], 'userGroup': job['userGroup'],
+                'userName': f"Load User {requester}", 'userCPFNo': f"load{requester}",
+                'userMobileNo': '9000000000',
+                'requestedByUserId': requester_id, 'requestedByUserCpfId': f"load{requester}",
+            }, requester_auth)
+            return status, status == 201
+        if operation == 'list_own_requisitions':
+            status, _ = client.request('GET', f"/api/requisitions?userId={requester_id}&limit=50",
+                                       headers=requester_auth)
+            return status, status == 200
+        if operation == 'bulk_decide':
+            status, body = client.request(
+                'GET', f"/api/requisitions?status=pending_level2&limit={bulk_size}&fields=id", headers=auth)
+            if status != 200:
+                return status, False
+            ids = [row['id'] for row in json.loads(body)['requisitions']]
+            if not ids:
+                return status, True
+            status, _ = client.request('POST', '/api/requisitions/bulk-status', {
+                'ids': ids, 'status': job['decision'],
+            }, auth)
+            return status, status == 200
+        status, _ = client.request('GET', '/api/requisitions/export?format=csv&status=pending_level2', headers=auth)
+        return status, status == 200
+
+    execute.client_factory = lambda: HttpClient(base_url, timeout)
+    recorder, wall_seconds = run_load(jobs(), execute, concurrency, rate, duration, seed)
+    report = recorder.report(wall_seconds)
+    print_report(report, output)
+    if report['total']['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
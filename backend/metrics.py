@@ -0,0 +1,102 @@
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+
+# With several gunicorn workers each process only sees its own samples. Point
+# PROMETHEUS_MULTIPROC_DIR at an empty directory shared by the workers (wiped
+# before gunicorn starts) and /metrics aggregates all of them.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time until the response headers were ready, per route.',
+    ['method', 'route'],
+)
+REQUESTS = Counter(
+    'http_requests_total', 'Requests served, per route and status code.',
+    ['method', 'route', 'status'],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests currently being handled.',
+    ['method', 'route'], multiprocess_mode='livesum',
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Response body size, for responses with a known length.',
+    ['method', 'route'], buckets=RESPONSE_SIZE_BUCKETS,
+)
+DB_CONNECT_SECONDS = Histogram(
+    'db_connect_seconds', 'Time spent opening new PostgreSQL connections.',
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    'db_pool_wait_seconds', 'Time to check a connection out of a pool, including opening one.',
+    ['pool'], buckets=POOL_WAIT_BUCKETS,
+)
+DB_POOL_EXHAUSTED = Counter(
+    'db_pool_exhausted_total', 'Checkouts that gave up because the pool stayed at max size.',
+    ['pool'],
+)
+DB_QUERY_SECONDS = Histogram(
+    'db_query_seconds', 'Time spent executing SQL statements, per statement kind.',
+    ['statement'],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    'password_hash_seconds', 'Time spent hashing or verifying passwords, including queueing.',
+    ['operation'],
+)
+PDF_RENDER_SECONDS = Histogram(
+    'pdf_render_seconds', 'Time from submitting a PDF render to its completion.',
+    ['outcome'],
+)
+
+_STATEMENT_KINDS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'COPY', 'WITH', 'BEGIN', 'COMMIT', 'ROLLBACK',
+                    'SAVEPOINT', 'RELEASE', 'CREATE', 'ALTER', 'DROP', 'LISTEN', 'NOTIFY', 'SET', 'EXPLAIN'}
+
+
+def statement_kind(query):
+    """First keyword of a SQL string, bucketed so labels stay low-cardinality."""
+    if isinstance(query, bytes):
+        query = query[:32].decode('utf-8', 'replace')
+    words = query.lstrip(' \t\r\n(').split(None, 1)
+    kind = words[0].upper() if words else ''
+    return kind if kind in _STATEMENT_KINDS else 'OTHER'
+
+
+def observe_query(query, seconds):
+    DB_QUERY_SECONDS.labels(statement_kind(query)).observe(seconds)
+
+
+def start_request(method, route):
+    REQUESTS_IN_PROGRESS.labels(method, route).inc()
+    return time.perf_counter()
+
+
+def finish_request(method, route, started, status_code, content_length):
+    REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+    REQUESTS.labels(method, route, str(status_code)).inc()
+    if content_length is not None:
+        RESPONSE_SIZE.labels(method, route).observe(content_length)
+
+
+def end_request(method, route):
+    REQUESTS_IN_PROGRESS.labels(method, route).dec()
+
+
+def render_latest():
+    """Returns (body, content type) for the /metrics endpoint."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Drops a dead worker's live gauges; call from gunicorn's child_exit hook."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
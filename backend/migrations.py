@@ -0,0 +1,342 @@
+import uuid
+
+import psycopg2
+
+from passwords import hash_password
+
+# Any constant works; it only has to be the same for every process running
+# migrations so that two release steps can't apply the same version at once.
+MIGRATION_LOCK_ID = 7314502
+
+
+def create_base_tables(cursor):
+    # Create users table (email column removed)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id VARCHAR(255) PRIMARY KEY,
+            cpf_id VARCHAR(255) UNIQUE NOT NULL,
+            name VARCHAR(255),
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            created_by VARCHAR(255)
+        )
+    ''')
+    # Create requisitions table - ADDED 'title' and 'description' back
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requisitions (
+            id VARCHAR(255) PRIMARY KEY,
+            title TEXT, -- Added back
+            description TEXT, -- Added back
+            requisition_date DATE,
+            basin VARCHAR(255),
+            block VARCHAR(255),
+            area VARCHAR(255),
+            dimension VARCHAR(255),
+            return_date DATE,
+            data_type TEXT,
+            objective TEXT,
+            remarks TEXT,
+            user_name VARCHAR(255),
+            user_designation VARCHAR(255),
+            user_cpf_no VARCHAR(255),
+            user_mobile_no VARCHAR(255),
+            user_group VARCHAR(255),
+            requested_by_user_id VARCHAR(255),
+            requested_by_user_cpf_id VARCHAR(255),
+            status VARCHAR(255) NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            approved_by_level2_user_id VARCHAR(255),
+            approved_by_level2_user_cpf_id VARCHAR(255),
+            approved_by_level2_user_name VARCHAR(255),
+            decision_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    ''')
+
+
+def create_filter_indexes(cursor):
+    # Indexes for the get_requisitions filters. Each one ends with the
+    # keyset pagination order so a filtered page is a single index range scan.
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_created_at "
+        "ON requisitions (created_at DESC, id DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_status_created_at "
+        "ON requisitions (status, created_at DESC, id DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_requested_by_created_at "
+        "ON requisitions (requested_by_user_id, created_at DESC, id DESC)"
+    )
+
+
+def create_trigram_indexes(cursor):
+    """Creates pg_trgm GIN indexes for the basin/userGroup ILIKE '%x%' filters.
+
+    Falls back to no index (sequential scan of the rows left by the other
+    filters) when the extension isn't installed or can't be created; it is
+    also listed in REPEATABLE_MIGRATIONS, so every later db-upgrade tries again.
+    """
+    cursor.execute("SAVEPOINT create_pg_trgm")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT create_pg_trgm")
+        print(f"pg_trgm extension unavailable, basin/userGroup filters will not be indexed "
+              f"(retried on the next db-upgrade): {e}")
+        return
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_basin_trgm "
+        "ON requisitions USING gin (basin gin_trgm_ops)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_user_group_trgm "
+        "ON requisitions USING gin (user_group gin_trgm_ops)"
+    )
+
+
+def create_change_tracking(cursor):
+    """Maintains requisitions.updated_at and records deletions as tombstones.
+
+    A trigger stamps updated_at on every insert and update, whatever code path
+    writes the row, so /api/requisitions/changes can rely on it.
+    """
+    cursor.execute("ALTER TABLE requisitions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE")
+    # Backfill rows that predate the column with their last known change.
+    cursor.execute("UPDATE requisitions SET updated_at = COALESCE(decision_at, created_at) WHERE updated_at IS NULL")
+    cursor.execute("ALTER TABLE requisitions ALTER COLUMN updated_at SET DEFAULT LOCALTIMESTAMP")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_updated_at ON requisitions (updated_at, id)"
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requisition_tombstones (
+            id VARCHAR(255) PRIMARY KEY,
+            deleted_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT LOCALTIMESTAMP
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisition_tombstones_deleted_at ON requisition_tombstones (deleted_at)"
+    )
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION requisitions_touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := LOCALTIMESTAMP;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION requisitions_record_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO requisition_tombstones (id, deleted_at) VALUES (OLD.id, LOCALTIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS requisitions_touch_updated_at ON requisitions")
+    cursor.execute(
+        "CREATE TRIGGER requisitions_touch_updated_at BEFORE INSERT OR UPDATE ON requisitions "
+        "FOR EACH ROW EXECUTE FUNCTION requisitions_touch_updated_at()"
+    )
+    cursor.execute("DROP TRIGGER IF EXISTS requisitions_record_tombstone ON requisitions")
+    cursor.execute(
+        "CREATE TRIGGER requisitions_record_tombstone AFTER DELETE ON requisitions "
+        "FOR EACH ROW EXECUTE FUNCTION requisitions_record_tombstone()"
+    )
+
+
+def create_requisition_counts(cursor):
+    """Maintains per (status, basin, user_group) counts for the dashboard summary.
+
+    Statement-level triggers fold every insert, update, delete and truncate
+    into requisition_counts inside the writing transaction, with one upsert
+    per affected group rather than per row, so bulk imports and bulk
+    decisions stay cheap. NULL basin/user_group are counted under ''.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requisition_counts (
+            status VARCHAR(255) NOT NULL,
+            basin VARCHAR(255) NOT NULL,
+            user_group VARCHAR(255) NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (status, basin, user_group)
+        )
+    ''')
+    # Groups are upserted in key order so concurrent writers lock counter rows
+    # in the same order instead of deadlocking.
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION requisitions_update_counts() RETURNS trigger AS $$
+        BEGIN
+            -- Each branch only names the transition tables its trigger defines.
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO requisition_counts AS counts (status, basin, user_group, count)
+                SELECT status, COALESCE(basin, ''), COALESCE(user_group, ''), count(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+                ON CONFLICT (status, basin, user_group) DO UPDATE SET count = counts.count + EXCLUDED.count;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO requisition_counts AS counts (status, basin, user_group, count)
+                SELECT status, basin, user_group, sum(delta)
+                FROM (
+                    SELECT status, COALESCE(basin, '') AS basin, COALESCE(user_group, '') AS user_group, 1 AS delta
+                    FROM new_rows
+                    UNION ALL
+                    SELECT status, COALESCE(basin, ''), COALESCE(user_group, ''), -1
+                    FROM old_rows
+                ) AS changes
+                GROUP BY 1, 2, 3 HAVING sum(delta) <> 0 ORDER BY 1, 2, 3
+                ON CONFLICT (status, basin, user_group) DO UPDATE SET count = counts.count + EXCLUDED.count;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO requisition_counts AS counts (status, basin, user_group, count)
+                SELECT status, COALESCE(basin, ''), COALESCE(user_group, ''), -count(*)
+                FROM old_rows
+                GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+                ON CONFLICT (status, basin, user_group) DO UPDATE SET count = counts.count + EXCLUDED.count;
+            ELSE
+                DELETE FROM requisition_counts;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    # Block writers while the counts are rebuilt so none is missed or counted twice.
+    cursor.execute("LOCK TABLE requisitions IN SHARE ROW EXCLUSIVE MODE")
+    for event, referencing in (
+        ('INSERT', 'REFERENCING NEW TABLE AS new_rows'),
+        ('UPDATE', 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+        ('DELETE', 'REFERENCING OLD TABLE AS old_rows'),
+        ('TRUNCATE', ''),
+    ):
+        trigger = f"requisitions_count_{event.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON requisitions")
+        cursor.execute(
+            f"CREATE TRIGGER {trigger} AFTER {event} ON requisitions {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION requisitions_update_counts()"
+        )
+    cursor.execute("DELETE FROM requisition_counts")
+    cursor.execute('''
+        INSERT INTO requisition_counts (status, basin, user_group, count)
+        SELECT status, COALESCE(basin, ''), COALESCE(user_group, ''), count(*)
+        FROM requisitions
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def create_search_vector(cursor):
+    """Adds the generated tsvector behind the `q=` search, with a GIN index.
+
+    Title weighs most, then description and objective, then remarks. Adding
+    a stored generated column rewrites the table once; afterwards PostgreSQL
+    keeps it current on every write.
+    """
+    cursor.execute('''
+        ALTER TABLE requisitions ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+            setweight(to_tsvector('english', COALESCE(description, '')), 'B') ||
+            setweight(to_tsvector('english', COALESCE(objective, '')), 'B') ||
+            setweight(to_tsvector('english', COALESCE(remarks, '')), 'C')
+        ) STORED
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_requisitions_search_vector ON requisitions USING gin (search_vector)"
+    )
+
+
+def create_default_admin(cursor):
+    # Add a default admin user if one doesn't exist
+    cursor.execute("SELECT id FROM users WHERE cpf_id = 'admin123'")
+    if cursor.fetchone() is None:
+        admin_id = str(uuid.uuid4())
+        hashed_password = hash_password('password123')
+        cursor.execute(
+            """INSERT INTO users (id, cpf_id, name, password_hash, role, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s)""",
+            (admin_id, 'admin123', 'Admin User', hashed_password, 'admin', 'system')
+        )
+        print("Default admin user created: CPF ID: admin123 / Password: password123")
+
+
+# (version, name, function taking a cursor). Append only: never renumber or
+# edit a migration that has shipped, add a new one instead. The early ones use
+# IF NOT EXISTS so databases created by the old import-time init_db adopt them.
+MIGRATIONS = [
+    (1, 'create_base_tables', create_base_tables),
+    (2, 'create_filter_indexes', create_filter_indexes),
+    (3, 'create_trigram_indexes', create_trigram_indexes),
+    (4, 'create_change_tracking', create_change_tracking),
+    (5, 'create_default_admin', create_default_admin),
+    (6, 'create_requisition_counts', create_requisition_counts),
+    (7, 'create_search_vector', create_search_vector),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# (name, function taking a cursor) run on every migrate() after the versioned
+# ones. Each must be idempotent; they cover steps that may only become
+# possible later, such as an extension installed after the first deploy.
+REPEATABLE_MIGRATIONS = [
+    ('create_trigram_indexes', create_trigram_indexes),
+]
+
+
+def schema_version(conn):
+    """Highest applied migration, 0 for a database that was never migrated.
+
+    Two cheap catalog/index lookups, suitable for a startup check.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    version = 0
+    if cursor.fetchone()[0]:
+        cursor.execute("SELECT COALESCE(max(version), 0) FROM schema_migrations")
+        version = cursor.fetchone()[0]
+    conn.rollback()
+    return version
+
+
+def migrate(conn, target=None):
+    """Applies pending migrations in order, each in its own transaction.
+
+    Returns the list of (version, name) applied. Safe to run from several
+    processes at once: they queue on an advisory lock.
+    """
+    target = LATEST_VERSION if target is None else target
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT LOCALTIMESTAMP
+        )
+    ''')
+    conn.commit()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    applied = []
+    try:
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+        for version, name, apply in MIGRATIONS:
+            if version in done or version > target:
+                continue
+            try:
+                apply(cursor)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append((version, name))
+        if target >= LATEST_VERSION:
+            for name, apply in REPEATABLE_MIGRATIONS:
+                try:
+                    apply(cursor)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied
@@ -0,0 +1,83 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from metrics import PASSWORD_HASH_SECONDS
+
+# Werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:1000000".
+# Stored hashes made with other parameters are upgraded on the next login.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# "thread" keeps hashing in-process (hashlib releases the GIL while hashing);
+# "process" moves it to separate processes entirely.
+PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Hashes allowed to be running or queued at once per worker, and how long a
+# request waits for a slot before it is turned away with a 503.
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 2))
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue stayed full for PASSWORD_HASH_QUEUE_TIMEOUT."""
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+_method_prefix = None
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                if PASSWORD_HASH_EXECUTOR == 'process':
+                    _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                   thread_name_prefix='password-hash')
+                _slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+                _executor_pid = os.getpid()
+    return _executor, _slots
+
+
+def _run(operation, fn, *args):
+    with PASSWORD_HASH_SECONDS.labels(operation).time():
+        return _submit(fn, *args)
+
+
+def _submit(fn, *args):
+    executor, slots = _get_executor()
+    if not slots.acquire(timeout=PASSWORD_HASH_QUEUE_TIMEOUT):
+        raise HashingBusy("Password hashing is at capacity, please retry shortly")
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    """Hashes `password` with the configured method on the hashing pool."""
+    return _run('hash', generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """Checks `password` against a stored hash on the hashing pool."""
+    return _run('verify', check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True when a stored hash was made with a different method or cost."""
+    global _method_prefix
+    if _method_prefix is None:
+        # Werkzeug expands short names ("scrypt") to their full parameters, so
+        # ask it once what the configured method looks like when stored.
+        _method_prefix = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _method_prefix
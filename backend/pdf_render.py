@@ -0,0 +1,220 @@
+import os
+import shutil
+import time
+import hashlib
+import datetime
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# ReportLab imports
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import Paragraph
+from io import BytesIO
+
+from metrics import PDF_RENDER_SECONDS
+
+# Rendered PDFs are kept on disk so every gunicorn worker can serve them.
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'requisition_pdf_cache'))
+# Size of the per-worker process pool that runs ReportLab.
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+
+
+def render_requisition_pdf(req_dict):
+    """Renders the requisition form for `req_dict` and returns the PDF bytes."""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter # Get document dimensions
+
+    # Set title font and draw
+    c.setFont('Helvetica-Bold', 18)
+    # FIX: Changed drawCentredText to drawCentredString
+    c.drawCentredString(width/2, height - 50, "User Data Requisition Form")
+
+    # Set content font
+    c.setFont('Helvetica', 10)
+
+    y_position = height - 80 # Starting Y position for content
+
+    styles = getSampleStyleSheet()
+    normal_style = styles['Normal']
+    bold_style = ParagraphStyle(
+        'Bold',
+        parent=normal_style,
+        fontName='Helvetica-Bold',
+        fontSize=10,
+        leading=12
+    )
+
+    def add_field(label, value, y_pos):
+        # Format value for display
+        display_value = value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+
+        # Use Paragraph for better text flow, especially for long remarks
+        # You can adjust width (e.g., 5.5*inch) to control wrapping
+        label_para = Paragraph(f"<b>{label}:</b>", bold_style)
+        value_para = Paragraph(display_value, normal_style)
+
+        # Draw label
+        label_para.wrapOn(c, 2*inch, 0.5*inch) # Label takes up 2 inches width
+        label_para.drawOn(c, inch, y_pos)
+
+        # Draw value - adjust X position
+        value_para.wrapOn(c, 5.5*inch, 0.5*inch) # Value takes up 5.5 inches width
+        value_para.drawOn(c, inch + 2*inch + 0.1*inch, y_pos) # Start value after label + a small gap
+
+        # Return new y_pos (approximate, adjust based on content)
+        return y_pos - max(label_para.height, value_para.height) - 5 # 5 is for padding
+
+
+    y_position = add_field("Requisition ID", req_dict.get('id', 'N/A'), y_position)
+    y_position = add_field("Date of Requisition", req_dict.get('requisition_date', 'N/A'), y_position)
+    y_position = add_field("Basin", req_dict.get('basin', 'N/A'), y_position)
+    y_position = add_field("Block", req_dict.get('block', 'N/A'), y_position)
+    y_position = add_field("Area", req_dict.get('area', 'N/A'), y_position)
+    y_position = add_field("2D/3D", req_dict.get('dimension', 'N/A'), y_position)
+    y_position = add_field("Return Date (Data to GMS)", req_dict.get('return_date', 'N/A'), y_position)
+    y_position = add_field("Type of Data Required", req_dict.get('data_type', 'N/A'), y_position)
+    y_position = add_field("Objective", req_dict.get('objective', 'N/A'), y_position)
+    y_position = add_field("Remarks", req_dict.get('remarks', 'N/A'), y_position)
+
+    y_position -= 15 # Add a gap
+    c.setFont('Helvetica-Bold', 14)
+    c.drawString(inch, y_position, "Requested By")
+    y_position -= 15 # Move down after section title
+
+    y_position = add_field("Name", req_dict.get('user_name', 'N/A'), y_position)
+    y_position = add_field("Designation", req_dict.get('user_designation', 'N/A'), y_position)
+    y_position = add_field("CPF No.", req_dict.get('user_cpf_no', 'N/A'), y_position)
+    y_position = add_field("Mobile No.", req_dict.get('user_mobile_no', 'N/A'), y_position)
+    y_position = add_field("Group", req_dict.get('user_group', 'N/A'), y_position)
+
+    y_position -= 15 # Add a gap
+    c.setFont('Helvetica-Bold', 14)
+    c.drawString(inch, y_position, "Approval Details")
+    y_position -= 15 # Move down after section title
+
+    status_display = req_dict.get('status', 'N/A').replace('_', ' ').title()
+    y_position = add_field("Status", status_display, y_position)
+    y_position = add_field("Approved/Denied By", req_dict.get('approved_by_level2_user_name') or req_dict.get('approved_by_level2_user_cpf_id') or 'N/A', y_position)
+    y_position = add_field("Decision Date", req_dict.get('decision_at', 'N/A'), y_position)
+
+
+
+    c.showPage() # End the current page
+    c.save() # Save the PDF to the buffer
+    return buffer.getvalue()
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+
+
+def cache_key(req_dict):
+    """Key identifying one rendering: it changes whenever status or decision_at do."""
+    decision_at = req_dict.get('decision_at')
+    if isinstance(decision_at, datetime.datetime):
+        decision_at = decision_at.isoformat()
+    return _digest(f"{req_dict['id']}|{req_dict.get('status')}|{decision_at}")
+
+
+def _requisition_dir(requisition_id):
+    # Hash the id so arbitrary URL input never becomes part of a path.
+    return os.path.join(PDF_CACHE_DIR, _digest(requisition_id))
+
+
+def cache_path(requisition_id, key):
+    return os.path.join(_requisition_dir(requisition_id), f"{key}.pdf")
+
+
+def cached_pdf(requisition_id, key):
+    """Returns the path of an already rendered PDF, or None."""
+    path = cache_path(requisition_id, key)
+    return path if os.path.exists(path) else None
+
+
+def render_to_cache(req_dict, path):
+    """Renders `req_dict` into `path` atomically. Runs inside the process pool."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pdf_bytes = render_requisition_pdf(req_dict)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
+
+
+def invalidate_requisition_pdfs(requisition_id):
+    """Drops every cached rendering of a requisition."""
+    shutil.rmtree(_requisition_dir(requisition_id), ignore_errors=True)
+
+
+_executor = None
+_executor_pid = None
+_jobs = {}  # cache path -> Future, for renders started by this process
+_jobs_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+        _executor_pid = os.getpid()
+        _jobs.clear()
+    return _executor
+
+
+def submit_render(req_dict):
+    """Starts rendering `req_dict` unless the same rendering is already running.
+
+    Returns the Future, whose result is the cache path of the PDF.
+    """
+    path = cache_path(req_dict['id'], cache_key(req_dict))
+    with _jobs_lock:
+        executor = _get_executor()
+        future = _jobs.get(path)
+        if future is None or (future.done() and future.exception() is not None):
+            future = executor.submit(render_to_cache, dict(req_dict), path)
+            _jobs[path] = future
+            started = time.perf_counter()
+            future.add_done_callback(lambda f: _observe_render(f, started))
+            future.add_done_callback(lambda f: _forget_job(path, f))
+    return future
+
+
+def _observe_render(future, started):
+    outcome = 'failed' if future.exception() is not None else 'rendered'
+    PDF_RENDER_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+
+def _forget_job(path, future):
+    # Successful renders are served from disk from now on; failed ones stay
+    # visible until retried so the status endpoint can report the error.
+    if future.exception() is None:
+        with _jobs_lock:
+            if _jobs.get(path) is future:
+                del _jobs[path]
+
+
+def render_status(req_dict):
+    """Returns ('ready' | 'rendering' | 'failed', error message or None)."""
+    key = cache_key(req_dict)
+    if cached_pdf(req_dict['id'], key):
+        return 'ready', None
+    with _jobs_lock:
+        future = _jobs.get(cache_path(req_dict['id'], key))
+    if future is not None and future.done() and future.exception() is not None:
+        return 'failed', str(future.exception())
+    if future is None:
+        # The render may have been started by another worker (or not at all);
+        # start one here so polling always makes progress.
+        submit_render(req_dict)
+    return 'rendering', None
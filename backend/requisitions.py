@@ -0,0 +1,337 @@
+import os
+import json
+import base64
+import hashlib
+import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from psycopg2 import sql
+
+PENDING_STATUS = 'pending_level2'
+DECISION_STATUSES = ('approved_level2', 'denied_level2')
+# Roles allowed to make bulk decisions. They always need a token, even when
+# REQUIRE_AUTH_TOKEN is off.
+BULK_DECISION_ROLES = {'level2', 'admin'}
+# Upper bound on the ids accepted by one bulk decision request.
+BULK_DECISION_MAX_IDS = int(os.environ.get('BULK_DECISION_MAX_IDS', 1000))
+
+# Request body key for each requisition column that clients may set.
+REQUEST_FIELDS = {
+    'requisition_date': 'requisitionDate',
+    'basin': 'basin',
+    'block': 'block',
+    'area': 'area',
+    'dimension': 'dimension',
+    'return_date': 'returnDate',
+    'data_type': 'dataType',
+    'objective': 'objective',
+    'remarks': 'remarks',
+    'user_name': 'userName',
+    'user_designation': 'userDesignation',
+    'user_cpf_no': 'userCPFNo',
+    'user_mobile_no': 'userMobileNo',
+    'user_group': 'userGroup',
+    'title': 'title',
+    'description': 'description',
+}
+MANDATORY_FIELDS = ['basin', 'user_cpf_no', 'user_mobile_no', 'user_group']
+# Every requisitions column, in table order.
+REQUISITION_COLUMNS = [
+    'id', 'title', 'description', 'requisition_date', 'basin', 'block', 'area', 'dimension', 'return_date',
+    'data_type', 'objective', 'remarks', 'user_name', 'user_designation',
+    'user_cpf_no', 'user_mobile_no', 'user_group', 'requested_by_user_id',
+    'requested_by_user_cpf_id', 'status', 'created_at', 'approved_by_level2_user_id',
+    'approved_by_level2_user_cpf_id', 'approved_by_level2_user_name', 'decision_at', 'updated_at',
+]
+# Column order used when inserting requisitions.
+INSERT_COLUMNS = [
+    'id', 'title', 'description', 'requisition_date', 'basin', 'block', 'area', 'dimension', 'return_date',
+    'data_type', 'objective', 'remarks', 'user_name', 'user_designation',
+    'user_cpf_no', 'user_mobile_no', 'user_group', 'requested_by_user_id',
+    'requested_by_user_cpf_id', 'status', 'created_at',
+]
+
+# Page sizes for keyset pagination of GET /api/requisitions.
+DEFAULT_PAGE_SIZE = int(os.environ.get('REQUISITIONS_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('REQUISITIONS_MAX_PAGE_SIZE', 500))
+# Rows fetched per round trip from the server-side cursor in streaming mode.
+STREAM_BATCH_SIZE = int(os.environ.get('REQUISITIONS_STREAM_BATCH_SIZE', 500))
+
+# Full-text search over the generated search_vector column. The text search
+# configuration must match the one the column is generated with.
+SEARCH_QUERY = "websearch_to_tsquery('english', %s)"
+SEARCH_CONDITION = f"search_vector @@ {SEARCH_QUERY}"
+SEARCH_RANK = f"ts_rank_cd(search_vector, {SEARCH_QUERY})"
+
+
+class InvalidQuery(ValueError):
+    """Raised for malformed list parameters; routes answer it with a 400."""
+
+
+def build_requisition_filters(args):
+    """Translates the list filters in `args` into SQL conditions and params.
+
+    Shared by every endpoint that lists requisitions so they all honour the
+    same status/userId/basin/userGroup/dimension/q semantics.
+    """
+    conditions = []
+    params = []
+
+    status_filter = args.get('status')
+    user_id_filter = args.get('userId')
+    basin_filter = args.get('basin')
+    user_group_filter = args.get('userGroup')
+    dimension_filter = args.get('dimension')
+    search = search_terms(args)
+
+    if status_filter:
+        conditions.append("status = %s")
+        params.append(status_filter)
+    if user_id_filter:
+        conditions.append("requested_by_user_id = %s")
+        params.append(user_id_filter)
+    if basin_filter:
+        conditions.append("basin ILIKE %s")
+        params.append(f"%{basin_filter}%")
+    if user_group_filter:
+        conditions.append("user_group ILIKE %s")
+        params.append(f"%{user_group_filter}%")
+    if dimension_filter:
+        conditions.append("dimension = %s")
+        params.append(dimension_filter)
+    if search:
+        conditions.append(SEARCH_CONDITION)
+        params.append(search)
+
+    return conditions, params
+
+
+def search_terms(args):
+    """The `q=` full-text search, or None when absent or blank.
+
+    Uses web search syntax: words are ANDed, "quoted phrases", `or` and
+    -exclusions are supported, and stemming makes "study" match "studies".
+    """
+    search = (args.get('q') or '').strip()
+    return search or None
+
+
+def where_clause(conditions):
+    """Joins conditions into a WHERE clause (empty string when there are none)."""
+    if not conditions:
+        return ""
+    return " WHERE " + " AND ".join(conditions)
+
+
+def parse_fields(value):
+    """Returns the columns requested with `fields=`, or every column.
+
+    Only names from REQUISITION_COLUMNS are accepted, so the list can be
+    spliced into SQL as identifiers.
+    """
+    if not value:
+        return list(REQUISITION_COLUMNS)
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in REQUISITION_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"Unknown field(s): {', '.join(unknown)}")
+    if not fields:
+        raise InvalidQuery("fields must name at least one column")
+    return fields
+
+
+def select_requisitions(fields, conditions, params, extra_columns=(), search=None):
+    """Builds the list SELECT for `fields` in keyset order, with its params.
+
+    `extra_columns` not already in `fields` are appended after them, so
+    zip(fields, row) still maps only the requested names. With a `search`,
+    rows come best match first and a trailing search_rank column is added
+    for the pagination cursor.
+    """
+    columns = fields + [column for column in extra_columns if column not in fields]
+    selected = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    order = "created_at DESC, id DESC"
+    query_params = list(params)
+    if search:
+        selected = sql.SQL("{}, {} AS search_rank").format(selected, sql.SQL(SEARCH_RANK))
+        order = "search_rank DESC, " + order
+        query_params.insert(0, search)
+        columns = columns + ['search_rank']
+    query = sql.SQL("SELECT {columns} FROM requisitions{where} ORDER BY {order}").format(
+        columns=selected,
+        where=sql.SQL(where_clause(conditions)),
+        order=sql.SQL(order),
+    )
+    return query, query_params, columns
+
+
+def select_changes(fields, conditions, params, since, limit):
+    """Builds the sync query for rows changed after `since`, in (updated_at, id) order.
+
+    The filters are evaluated as a column instead of a WHERE clause so rows
+    that left the filtered set can be reported as removed. After `since`,
+    tombstones are merged in at their (deleted_at, id) position with matches
+    false, so deletions are paged through with the changes they interleave
+    with. Each row is `fields` followed by matches, updated_at and id.
+    """
+    matches = " AND ".join(conditions) if conditions else "TRUE"
+    query_params = list(params)
+    where = ""
+    tombstones = ""
+    if since:
+        where = " WHERE (updated_at, id) > (%s, %s)"
+        tombstones = (" UNION ALL SELECT " + "NULL, " * len(fields) + "FALSE, deleted_at, id "
+                      "FROM requisition_tombstones WHERE (deleted_at, id) > (%s, %s)")
+        query_params.extend(since)
+        query_params.extend(since)
+    elif conditions:
+        # Initial sync: only rows that currently match are of interest.
+        where = " WHERE " + matches
+        query_params.extend(params)
+    query_params.append(limit)
+    # The position columns are aliased so ORDER BY can't collide with an "id"
+    # or "updated_at" requested in `fields`.
+    query = sql.SQL("SELECT {fields}, ({matches}) AS matches, updated_at AS position_at, id AS position_id "
+                    "FROM requisitions{where}{tombstones} ORDER BY position_at, position_id LIMIT %s").format(
+        fields=sql.SQL(', ').join(sql.Identifier(field) for field in fields),
+        matches=sql.SQL(matches),
+        where=sql.SQL(where),
+        tombstones=sql.SQL(tombstones),
+    )
+    return query, query_params
+
+
+def decode_sync_token(token):
+    """Returns the (updated_at, id) position encoded in a changes `nextToken`."""
+    try:
+        position = decode_cursor(token)
+    except InvalidQuery:
+        position = None
+    if position is None or len(position) != 2:
+        raise InvalidQuery("Invalid since token")
+    return position
+
+
+def is_paginated(args):
+    return 'limit' in args or 'cursor' in args
+
+
+def parse_page_size(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise InvalidQuery("limit must be an integer")
+    if page_size < 1:
+        raise InvalidQuery("limit must be at least 1")
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def encode_cursor(created_at, requisition_id, rank=None):
+    """Builds the opaque cursor pointing just after the given row.
+
+    Search results are ordered by rank first, so their cursors carry it too.
+    """
+    position = [created_at.isoformat(), requisition_id]
+    if rank is not None:
+        position.append(rank)
+    payload = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the (created_at, id) pair encoded by encode_cursor, plus the rank if any."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, requisition_id, *rank = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(rank) > 1:
+            raise ValueError("too many values")
+        return (datetime.datetime.fromisoformat(created_at), str(requisition_id)) + tuple(float(r) for r in rank)
+    except (ValueError, TypeError, UnicodeEncodeError):
+        raise InvalidQuery("Invalid cursor")
+
+
+def keyset_condition(cursor, search=None):
+    """Condition selecting rows after `cursor` in the listing order.
+
+    That is created_at DESC, id DESC, preceded by the rank for a `search`.
+    """
+    position = decode_cursor(cursor)
+    if not search:
+        if len(position) != 2:
+            raise InvalidQuery("Invalid cursor")
+        return "(created_at, id) < (%s, %s)", list(position)
+    if len(position) != 3:
+        raise InvalidQuery("Cursor does not belong to this search")
+    created_at, requisition_id, rank = position
+    # ts_rank_cd returns real: compare as real so the boundary row matches exactly.
+    return f"({SEARCH_RANK}, created_at, id) < (%s::real, %s, %s)", [search, rank, created_at, requisition_id]
+
+
+def page_validator(path, positions):
+    """ETag and Last-Modified for one keyset page from its (id, updated_at) rows.
+
+    Pass the extra LIMIT n+1 row too, so the tag also changes when another
+    page appears or disappears. Counting the whole filtered set instead would
+    cost more than the page itself.
+    """
+    digest = hashlib.sha1(path.encode('utf-8'))
+    last_modified = None
+    for requisition_id, updated_at in positions:
+        digest.update(f"|{requisition_id}|{updated_at.isoformat() if updated_at else ''}".encode('utf-8'))
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    return digest.hexdigest(), last_modified
+
+
+def utc_timestamp(value, timezone_name=None):
+    """Naive timestamp column as an aware UTC datetime, for Last-Modified.
+
+    LOCALTIMESTAMP columns (updated_at) hold wall-clock time in the server's
+    TimeZone setting, so pass that; values written with datetime.now()
+    (decision_at) are in this process's zone, so pass None.
+    """
+    if value is None or value.tzinfo is not None:
+        return value
+    if timezone_name:
+        try:
+            return value.replace(tzinfo=ZoneInfo(timezone_name)).astimezone(datetime.timezone.utc)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass  # e.g. a POSIX-style offset; assume it matches this process
+    return value.astimezone(datetime.timezone.utc)
+
+
+def build_requisition_data(data, requested_by_user_id, requested_by_user_cpf_id, created_at=None):
+    """Maps a create-requisition payload onto requisition columns."""
+    return {
+        'requisition_date': data.get('requisitionDate'),
+        'basin': data.get('basin'),
+        'block': data.get('block'),
+        'area': data.get('area'),
+        'dimension': data.get('dimension'),
+        'return_date': data.get('returnDate'),
+        'data_type': data.get('dataType'),
+        'objective': data.get('objective'),
+        'remarks': data.get('remarks'),
+        'user_name': data.get('userName'),
+        'user_designation': data.get('userDesignation'),
+        'user_cpf_no': data.get('userCPFNo'),
+        'user_mobile_no': data.get('userMobileNo'),
+        'user_group': data.get('userGroup'),
+        'requested_by_user_id': requested_by_user_id,
+        'requested_by_user_cpf_id': requested_by_user_cpf_id,
+        'status': PENDING_STATUS,
+        'created_at': created_at or datetime.datetime.now(),
+        # Generate title and description from existing fields if not directly provided
+        'title': data.get('title', f"Requisition for {data.get('basin')} - {data.get('area') or 'N/A'}"),
+        'description': data.get('description', data.get('objective'))
+    }
+
+
+def missing_mandatory_field(requisition_data):
+    """Returns the error message for the first missing mandatory field, or None."""
+    for field in MANDATORY_FIELDS:
+        if not requisition_data.get(field):
+            return f"Mandatory field '{field.replace('_', ' ').capitalize()}' is missing"
+    return None
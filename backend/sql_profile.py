@@ -0,0 +1,114 @@
+import os
+import re
+import contextvars
+from functools import lru_cache
+
+from metrics import observe_query
+
+# Statements slower than this many milliseconds are printed with their
+# fingerprint, duration, parameter count and row count. 0 logs everything.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# Per-fingerprint entries returned in one Server-Timing header, slowest first.
+SQL_PROFILE_MAX_ENTRIES = int(os.environ.get('SQL_PROFILE_MAX_ENTRIES', 15))
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_REPEATED_LIST = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(query):
+    """Normalizes a statement so runs that differ only in values group together.
+
+    Literals and placeholders become ?, IN lists and multi-row VALUES
+    collapse to a single "(?, ...)", and whitespace is squeezed.
+    """
+    # Query templates repeat and are cached; bulk statements with their
+    # values inlined (execute_values) are long and unique, so they aren't.
+    if len(query) > 2000:
+        return _fingerprint(query)
+    return _cached_fingerprint(query)
+
+
+def _fingerprint(query):
+    query = _STRING_LITERAL.sub('?', query)
+    query = _PLACEHOLDER.sub('?', query)
+    query = _NUMBER.sub('?', query)
+    query = _LIST.sub('(?, ...)', query)
+    query = _REPEATED_LIST.sub('(?, ...), ...', query)
+    return _WHITESPACE.sub(' ', query).strip()
+
+
+_cached_fingerprint = lru_cache(maxsize=1024)(_fingerprint)
+
+
+class RequestProfile:
+    """SQL statements run while handling one request, grouped by fingerprint."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.by_fingerprint = {}  # fingerprint -> [count, seconds, rows]
+
+    def add(self, statement, seconds, rows):
+        self.queries += 1
+        self.seconds += seconds
+        entry = self.by_fingerprint.setdefault(statement, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += max(rows or 0, 0)
+
+    def server_timing(self):
+        """Formats the profile as a Server-Timing header value (durations in ms)."""
+        metrics = [f'sql;dur={self.seconds * 1000:.2f};desc="{self.queries} queries"']
+        slowest = sorted(self.by_fingerprint.items(), key=lambda item: item[1][1], reverse=True)
+        for number, (statement, (count, seconds, rows)) in enumerate(slowest[:SQL_PROFILE_MAX_ENTRIES], 1):
+            desc = f"x{count} {rows} rows: {statement[:200]}".replace('\\', '\\\\').replace('"', '\\"')
+            metrics.append(f'sql-{number};dur={seconds * 1000:.2f};desc="{desc}"')
+        return ', '.join(metrics)
+
+
+_current_profile = contextvars.ContextVar('sql_profile', default=None)
+
+
+def start_profile():
+    _current_profile.set(RequestProfile())
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def finish_profile():
+    """Stops collecting for the current request and returns what was collected."""
+    profile = _current_profile.get()
+    _current_profile.set(None)
+    return profile
+
+
+def _param_count(params):
+    if params is None:
+        return 0
+    try:
+        return len(params)
+    except TypeError:
+        return 0
+
+
+def record_query(query, params, seconds, rows):
+    """Called by the instrumented cursor after every statement."""
+    observe_query(query, seconds)
+    profile = _current_profile.get()
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    if profile is None and not slow:
+        return
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    statement = fingerprint(query)
+    if profile is not None:
+        profile.add(statement, seconds, rows)
+    if slow:
+        print(f"Slow query ({seconds * 1000:.1f} ms, {_param_count(params)} params, "
+              f"{rows if rows is not None and rows >= 0 else '?'} rows): {statement}")
@@ -0,0 +1,84 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# The backend modules import each other as top-level modules (from db import ...).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Tokens can only be issued with a signing key, and auth reads it at import.
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+
+
+@pytest.fixture(scope='session')
+def database():
+    """The DATABASE_URL database, migrated; tests using it are skipped without one."""
+    import psycopg2
+    from db import DATABASE_URL, db_connection
+    from migrations import migrate
+
+    if not DATABASE_URL:
+        pytest.skip("DATABASE_URL is not set")
+    try:
+        with db_connection() as conn:
+            migrate(conn)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Database unavailable: {e}")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import app as app_module
+    # The schema is migrated by the `database` fixture; tests that don't need
+    # the database must not reach it from the before_request check either.
+    monkeypatch.setattr(app_module, '_schema_checked', True)
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def auth_header():
+    """Builds an Authorization header for a made-up user with the given role."""
+    from auth import issue_token
+
+    def build(role):
+        user_id = str(uuid.uuid4())
+        token = issue_token({'id': user_id, 'cpf_id': f"cpf-{user_id[:8]}", 'name': f"Test {role}", 'role': role})
+        return {'Authorization': f"Bearer {token}"}
+    return build
+
+
+@pytest.fixture
+def make_requisitions(database, client, auth_header):
+    """Creates requisitions through the API in a basin unique to the test; deletes them afterwards.
+
+    Returns a function taking the number of rows (and extra payload keys)
+    and returning their ids in creation order. The basin is exposed as
+    `make_requisitions.basin` for filtering.
+    """
+    from db import db_connection
+
+    basin = f"pytest-{uuid.uuid4().hex[:12]}"
+    headers = auth_header('requester')
+
+    def make(count, **payload):
+        ids = []
+        for n in range(count):
+            response = client.post('/api/requisitions', headers=headers, json={
+                'title': f"Requisition {n}",
+                'basin': basin,
+                'userCPFNo': '12345678900',
+                'userMobileNo': '5550100',
+                'userGroup': 'pytest',
+                **payload,
+            })
+            assert response.status_code == 201, response.get_json()
+            ids.append(response.get_json()['id'])
+        return ids
+
+    make.basin = basin
+    yield make
+
+    with db_connection() as conn:
+        conn.cursor().execute("DELETE FROM requisitions WHERE basin = %s", (basin,))
+        conn.commit()
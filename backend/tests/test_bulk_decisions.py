@@ -0,0 +1,57 @@
+import pytest
+
+from db import db_connection
+
+URL = '/api/requisitions/bulk-status'
+
+
+def test_anonymous_callers_are_challenged(client):
+    response = client.post(URL, json={'ids': ['x'], 'status': 'approved_level2'})
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'].startswith('Bearer')
+
+
+def test_invalid_token_is_not_enough(client):
+    response = client.post(URL, headers={'Authorization': 'Bearer forged'},
+                           json={'ids': ['x'], 'status': 'approved_level2'})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('role', ['requester', 'level1'])
+def test_other_roles_are_forbidden(client, auth_header, role):
+    response = client.post(URL, headers=auth_header(role), json={'ids': ['x'], 'status': 'approved_level2'})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('body', [
+    {'ids': [], 'status': 'approved_level2'},
+    {'ids': 'abc', 'status': 'approved_level2'},
+    {'ids': [1, 2], 'status': 'approved_level2'},
+    {'ids': ['x'], 'status': 'pending_level2'},
+])
+def test_malformed_requests_are_rejected(client, auth_header, body):
+    assert client.post(URL, headers=auth_header('admin'), json=body).status_code == 400
+
+
+def test_decides_pending_requisitions_once(client, make_requisitions, auth_header):
+    ids = make_requisitions(2)
+    headers = auth_header('level2')
+
+    response = client.post(URL, headers=headers, json={'ids': [ids[0], ids[0], 'missing'], 'status': 'denied_level2'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['updated'] == 1
+    assert body['results'] == [
+        {'id': ids[0], 'outcome': 'updated'},
+        {'id': 'missing', 'outcome': 'not_found'},
+    ]
+
+    # A second approver arriving later doesn't overwrite the first decision.
+    response = client.post(URL, headers=auth_header('admin'), json={'ids': ids, 'status': 'approved_level2'})
+    assert [result['outcome'] for result in response.get_json()['results']] == ['already_decided', 'updated']
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, approved_by_level2_user_name FROM requisitions WHERE id = %s", (ids[0],))
+        assert cursor.fetchone() == ('denied_level2', 'Test level2')
+        conn.rollback()
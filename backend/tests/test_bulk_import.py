@@ -0,0 +1,63 @@
+import io
+import json
+
+import pytest
+
+from bulk_import import ImportFormatError, prepare_records, read_records
+
+RECORD = {
+    'basin': 'Santos',
+    'user_cpf_no': '12345678900',
+    'user_mobile_no': '5550100',
+    'user_group': 'Geology',
+    'requisition_date': '2026-02-01',
+}
+
+
+def read(content, filename):
+    return read_records(io.BytesIO(content.encode('utf-8')), filename)
+
+
+def test_json_column_names_are_normalized():
+    records = read(json.dumps([dict(RECORD, basin='  Santos ', remarks='   ')]), 'requisitions.json')
+    assert records == [{
+        'basin': 'Santos',
+        'userCPFNo': '12345678900',
+        'userMobileNo': '5550100',
+        'userGroup': 'Geology',
+        'requisitionDate': '2026-02-01',
+        'remarks': None,
+    }]
+
+
+def test_csv_and_json_agree():
+    header = ','.join(RECORD)
+    values = ','.join(RECORD.values())
+    assert read(f"{header}\n{values}\n", 'requisitions.csv') == read(json.dumps([RECORD]), 'requisitions.json')
+
+
+def test_aliased_json_records_pass_validation():
+    rows, errors = prepare_records(read(json.dumps([RECORD]), 'requisitions.json'))
+    assert errors == []
+    (index, data), = rows
+    assert index == 0
+    assert data['user_cpf_no'] == '12345678900'
+    assert data['requisition_date'] == '2026-02-01'
+
+
+def test_invalid_records_are_reported_by_position():
+    records = read(json.dumps([RECORD, 'not an object', dict(RECORD, user_group=None)]), 'requisitions.json')
+    rows, errors = prepare_records(records, requested_by_user_id='u1', requested_by_user_cpf_id='c1')
+    assert [index for index, _ in rows] == [0]
+    assert rows[0][1]['requested_by_user_id'] == 'u1'
+    assert [error['index'] for error in errors] == [1, 2]
+
+
+@pytest.mark.parametrize('content, filename', [
+    ('{"basin": "Santos"}', 'requisitions.json'),
+    ('[', 'requisitions.json'),
+    ('basin\nSantos\n', 'requisitions.txt'),
+])
+def test_unreadable_files_are_rejected(content, filename):
+    with pytest.raises(ImportFormatError):
+        read(content, filename)
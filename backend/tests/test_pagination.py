@@ -0,0 +1,106 @@
+import datetime
+
+import pytest
+
+from requisitions import (
+    InvalidQuery, decode_cursor, decode_sync_token, encode_cursor, keyset_condition, page_validator, utc_timestamp,
+)
+
+CREATED_AT = datetime.datetime(2026, 3, 14, 15, 9, 26, 535897)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(CREATED_AT, 'abc')) == (CREATED_AT, 'abc')
+    assert decode_cursor(encode_cursor(CREATED_AT, 'abc', 0.25)) == (CREATED_AT, 'abc', 0.25)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not-a-cursor', '!!!', 'WzEsMiwzLDRd'])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidQuery):
+        decode_cursor(cursor)
+
+
+def test_keyset_condition_continues_after_the_cursor_row():
+    condition, params = keyset_condition(encode_cursor(CREATED_AT, 'abc'))
+    assert condition == "(created_at, id) < (%s, %s)"
+    assert params == [CREATED_AT, 'abc']
+
+
+def test_search_keyset_condition_starts_with_the_rank():
+    condition, params = keyset_condition(encode_cursor(CREATED_AT, 'abc', 0.5), search='pipeline')
+    assert condition.endswith("created_at, id) < (%s::real, %s, %s)")
+    assert params == ['pipeline', 0.5, CREATED_AT, 'abc']
+
+
+def test_cursor_must_match_the_search():
+    with pytest.raises(InvalidQuery):
+        keyset_condition(encode_cursor(CREATED_AT, 'abc', 0.5))
+    with pytest.raises(InvalidQuery):
+        keyset_condition(encode_cursor(CREATED_AT, 'abc'), search='pipeline')
+
+
+def test_sync_token_is_a_plain_position():
+    assert decode_sync_token(encode_cursor(CREATED_AT, 'abc')) == (CREATED_AT, 'abc')
+    with pytest.raises(InvalidQuery):
+        decode_sync_token(encode_cursor(CREATED_AT, 'abc', 0.5))
+
+
+def test_page_validator_follows_the_fetched_rows():
+    later = CREATED_AT + datetime.timedelta(seconds=1)
+    rows = [('a', CREATED_AT), ('b', later)]
+    etag, last_modified = page_validator('/api/requisitions?limit=1', rows)
+    assert last_modified == later
+    assert page_validator('/api/requisitions?limit=1', list(rows))[0] == etag
+    # An edited row, a new extra row or another query string all change the tag.
+    assert page_validator('/api/requisitions?limit=1', [('a', later), ('b', later)])[0] != etag
+    assert page_validator('/api/requisitions?limit=1', rows + [('c', None)])[0] != etag
+    assert page_validator('/api/requisitions?limit=2', rows)[0] != etag
+
+
+def test_utc_timestamp_uses_the_server_timezone():
+    utc = datetime.timezone.utc
+    assert utc_timestamp(CREATED_AT, 'America/Sao_Paulo') == CREATED_AT.replace(tzinfo=utc) + datetime.timedelta(hours=3)
+    assert utc_timestamp(CREATED_AT, 'Etc/UTC') == CREATED_AT.replace(tzinfo=utc)
+    assert utc_timestamp(None, 'Etc/UTC') is None
+
+
+def test_pages_return_every_row_once(client, make_requisitions):
+    ids = make_requisitions(5)
+    seen = []
+    url = f"/api/requisitions?basin={make_requisitions.basin}&limit=2&fields=id"
+    cursor = None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        body = response.get_json()
+        seen.extend(row['id'] for row in body['requisitions'])
+        cursor = body['nextCursor']
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(ids)
+    assert len(seen) == len(set(seen))
+
+
+def test_search_pages_return_every_match_once(client, make_requisitions):
+    word = f"zebrafish{make_requisitions.basin[-6:]}"
+    ids = make_requisitions(3, title=f"Survey {word}", description=word)
+    make_requisitions(2, title="Unrelated survey")
+    seen = []
+    url = f"/api/requisitions?basin={make_requisitions.basin}&q={word}&limit=1&fields=id"
+    cursor = None
+    while True:
+        body = client.get(url + (f"&cursor={cursor}" if cursor else "")).get_json()
+        seen.extend(row['id'] for row in body['requisitions'])
+        cursor = body['nextCursor']
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(ids)
+
+
+def test_unchanged_page_is_not_modified(client, make_requisitions):
+    make_requisitions(2)
+    url = f"/api/requisitions?basin={make_requisitions.basin}&limit=5"
+    first = client.get(url)
+    assert first.headers['Last-Modified'].endswith('GMT')
+    again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
@@ -0,0 +1,65 @@
+from db import db_connection
+
+
+def sync(client, url, since, limit):
+    """Follows nextToken until hasMore is false; returns (changed ids, removed ids, final token, pages)."""
+    changed, removed, pages = [], [], 0
+    while True:
+        response = client.get(f"{url}&limit={limit}&since={since}")
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        changed.extend(row['id'] for row in body['changes'])
+        removed.extend(body['removed'])
+        since = body['nextToken']
+        pages += 1
+        if not body['hasMore']:
+            return changed, removed, since, pages
+
+
+def initial_token(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.get_json()['nextToken']
+
+
+def test_invalid_since_token_is_rejected(client):
+    response = client.get('/api/requisitions/changes?since=not-a-token')
+    assert response.status_code == 400
+
+
+def test_deletions_are_reported_on_every_page(client, make_requisitions):
+    url = f"/api/requisitions/changes?basin={make_requisitions.basin}&fields=id"
+    since = initial_token(client, url)
+    # Each deletion is followed by more writes, so it falls on an early page.
+    ids = []
+    deleted = []
+    for _ in range(3):
+        batch = make_requisitions(3)
+        with db_connection() as conn:
+            conn.cursor().execute("DELETE FROM requisitions WHERE id = %s", (batch[0],))
+            conn.commit()
+        ids.extend(batch)
+        deleted.append(batch[0])
+
+    changed, removed, _, pages = sync(client, url, since, limit=2)
+    # Tombstones of other tests may appear too; only this test's rows are checked.
+    assert pages > 1
+    assert sorted(set(changed) & set(ids)) == sorted(set(ids) - set(deleted))
+    assert set(deleted) <= set(removed)
+    assert not set(deleted) & set(changed)
+
+
+def test_rows_leaving_the_filter_are_removed(client, make_requisitions, auth_header):
+    url = f"/api/requisitions/changes?basin={make_requisitions.basin}&status=pending_level2&fields=id"
+    since = initial_token(client, url)
+    ids = make_requisitions(3)
+    changed, _, since, _ = sync(client, url, since, limit=10)
+    assert set(ids) <= set(changed)
+
+    response = client.post('/api/requisitions/bulk-status', headers=auth_header('level2'),
+                           json={'ids': ids[:1], 'status': 'approved_level2'})
+    assert response.status_code == 200
+
+    changed, removed, _, _ = sync(client, url, since, limit=1)
+    assert ids[0] in removed
+    assert ids[0] not in changed